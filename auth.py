@@ -1,10 +1,16 @@
 import hashlib
 import os
 import base64
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from bottle import request, response, redirect
 from itsdangerous import URLSafeSerializer, BadSignature
 import config
-from models import User
+import services
+from peewee import fn
+from models import db, User, LoginFailure
 
 serializer = URLSafeSerializer(config.SECRET_KEY)
 
@@ -26,27 +32,159 @@ def verify_password(password, salt, stored_hash):
     new_hash, _ = hash_password(password, salt)
     return new_hash == stored_hash
 
+# --- ログイン時のパスワード検証の同時実行制限 ---
+class LoginBusy(Exception):
+    """検証待ちが上限に達しているため受け付けられない"""
+
+_verify_executor = None
+_verify_slots = threading.BoundedSemaphore(config.LOGIN_VERIFY_WORKERS + config.LOGIN_VERIFY_QUEUE)
+_verify_lock = threading.Lock()
+
+def _get_verify_executor():
+    global _verify_executor
+    with _verify_lock:
+        if _verify_executor is None:
+            _verify_executor = ThreadPoolExecutor(max_workers=config.LOGIN_VERIFY_WORKERS,
+                                                  thread_name_prefix='password-verify')
+        return _verify_executor
+
+def verify_password_bounded(password, salt, stored_hash):
+    """
+    同時に実行するPBKDF2の数を LOGIN_VERIFY_WORKERS に制限して検証する
+    待ち行列が LOGIN_VERIFY_QUEUE を超える場合は LoginBusy を送出する
+    """
+    if not _verify_slots.acquire(blocking=False):
+        raise LoginBusy()
+    try:
+        return _get_verify_executor().submit(verify_password, password, salt, stored_hash).result()
+    finally:
+        _verify_slots.release()
+
+# --- ログイン失敗の抑止 ---
+# 失敗は LoginFailure テーブルに記録し、CGI や複数プロセスでも同じ回数で制限する
+def _failure_keys(username, remote_addr):
+    return [('user', username or '', config.LOGIN_MAX_FAILURES),
+            ('ip', remote_addr or '', config.LOGIN_MAX_FAILURES_PER_IP)]
+
+def _failure_window_start():
+    return datetime.datetime.now() - datetime.timedelta(seconds=config.LOGIN_FAILURE_WINDOW)
+
+def is_login_throttled(username, remote_addr):
+    """
+    直近 LOGIN_FAILURE_WINDOW 秒の失敗回数が上限に達していれば True（パスワード検証の前に判定する）
+    """
+    keys = _failure_keys(username, remote_addr)
+    matches = [(LoginFailure.kind == kind) & (LoginFailure.value == value) for kind, value, _ in keys]
+    counts = dict(LoginFailure
+                  .select(LoginFailure.kind, fn.COUNT(LoginFailure.id))
+                  .where(LoginFailure.failed_at >= _failure_window_start(), matches[0] | matches[1])
+                  .group_by(LoginFailure.kind)
+                  .tuples())
+    return any(counts.get(kind, 0) >= limit for kind, _, limit in keys)
+
+def record_login_failure(username, remote_addr):
+    now = datetime.datetime.now()
+    with db.atomic('IMMEDIATE'):
+        # 期間を過ぎた記録はここで削除する（大量のユーザー名で試行されても増え続けない）
+        LoginFailure.delete().where(LoginFailure.failed_at < _failure_window_start()).execute()
+        LoginFailure.insert_many([{'kind': kind, 'value': value, 'failed_at': now}
+                                  for kind, value, _ in _failure_keys(username, remote_addr)]).execute()
+
+def clear_login_failures(username):
+    LoginFailure.delete().where(LoginFailure.kind == 'user', LoginFailure.value == (username or '')).execute()
+
+def calibrate_hash(iterations=None, rounds=3):
+    """
+    パスワードハッシュ1回あたりの所要時間（ミリ秒、中央値）を計測する
+    """
+    iterations = iterations or config.HASH_ITERATIONS
+    salt = os.urandom(16)
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        hashlib.pbkdf2_hmac('sha256', b'calibration', salt, iterations)
+        timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+# リクエスト単位で解決済みのセッション・ユーザーを保持する environ のキー
+_SESSION_KEY = 'wardboard.session'
+_USER_KEY = 'wardboard.user'
+
+# ロール情報付きセッション（claim）の失効カウンタ
+# CacheVersion（'users'）に保持し、ユーザーの無効化・ロール変更時に上げると発行済みの claim が使われなくなる
+# 同じプロセスには即時、他のプロセスには SESSION_CLAIM_CHECK_INTERVAL 秒以内に反映される
+CLAIM_VERSION_KEY = 'users'
+_claim_revision = None  # (バージョン, 確認した時刻)
+_claim_lock = threading.Lock()
+
+def current_claim_revision():
+    global _claim_revision
+    with _claim_lock:
+        now = time.monotonic()
+        if _claim_revision is None or now - _claim_revision[1] >= config.SESSION_CLAIM_CHECK_INTERVAL:
+            _claim_revision = (services.get_cache_version(CLAIM_VERSION_KEY), now)
+        return _claim_revision[0]
+
+def revoke_claims():
+    """
+    ユーザーの変更と同じトランザクション内で呼ぶ: 全プロセスの発行済みの claim を失効させる
+    """
+    global _claim_revision
+    services.bump_cache_version(CLAIM_VERSION_KEY)
+    with _claim_lock:
+        _claim_revision = None
+
 def get_session():
+    if _SESSION_KEY in request.environ:
+        return request.environ[_SESSION_KEY]
+    session = None
     session_cookie = request.get_cookie(config.SESSION_NAME)
-    if not session_cookie:
-        return None
-    try:
-        return serializer.loads(session_cookie)
-    except BadSignature:
-        return None
+    if session_cookie:
+        try:
+            session = serializer.loads(session_cookie)
+        except BadSignature:
+            session = None
+    request.environ[_SESSION_KEY] = session
+    return session
 
 def set_session(user_data):
     session_cookie = serializer.dumps(user_data)
     response.set_cookie(config.SESSION_NAME, session_cookie, path='/', httponly=True)
+    request.environ[_SESSION_KEY] = user_data
+    request.environ.pop(_USER_KEY, None)
 
 def delete_session():
     response.delete_cookie(config.SESSION_NAME, path='/')
+    request.environ[_SESSION_KEY] = None
+    request.environ.pop(_USER_KEY, None)
 
 def get_current_user():
+    # 同一リクエスト内（role_required とハンドラなど）では1回だけ解決する
+    if _USER_KEY not in request.environ:
+        request.environ[_USER_KEY] = _resolve_user()
+    return request.environ[_USER_KEY]
+
+def _resolve_user():
     session = get_session()
     if not session or 'user_id' not in session:
         return None
-    return User.get_or_none(User.id == session['user_id'], User.is_active == True)
+
+    # 有効期限内の claim があればDBを参照せずにユーザーを復元する
+    claim = session.get('claim')
+    if (config.SESSION_CLAIM_TTL > 0 and claim
+            and claim.get('exp', 0) > time.time() and claim.get('rev') == current_claim_revision()):
+        return User(id=session['user_id'], username=claim['username'], role=claim['role'], is_active=True)
+
+    user = User.get_or_none(User.id == session['user_id'], User.is_active == True)
+    if user and config.SESSION_CLAIM_TTL > 0:
+        session = dict(session, claim={
+            'username': user.username,
+            'role': user.role,
+            'exp': int(time.time()) + config.SESSION_CLAIM_TTL,
+            'rev': current_claim_revision()
+        })
+        set_session(session)
+    return user
 
 def login_required(callback):
     def wrapper(*args, **kwargs):
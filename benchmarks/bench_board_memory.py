@@ -0,0 +1,55 @@
+"""
+ボードのキャッシュ（全エリア分）のメモリ使用量
+
+    python benchmarks/bench_board_memory.py [--areas 25] [--rooms 100] [--beds 4]
+
+既定では 25エリア x 100部屋 x 4ベッド = 10,000床の病院を作成し、
+全エリアのボードデータを読み込んだときに保持されるメモリ量と読み込み時間を表示する
+"""
+import argparse
+import gc
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from common import setup_database
+import services
+from models import db
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--areas', type=int, default=25)
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--beds', type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        area_ids, bed_ids = setup_database(os.path.join(workdir, 'bench.db'), areas=args.areas,
+                                           rooms_per_area=args.rooms, beds_per_room=args.beds)
+        db.connect(reuse_if_open=True)
+        # 状態マスタの読み込みは計測に含めない
+        services.status_registry.active()
+
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        boards = [services._load_board_data(area_id) for area_id in area_ids]
+        elapsed = time.perf_counter() - start
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        db.close()
+
+        rooms = sum(len(board) for board in boards)
+        print(f"areas={len(area_ids)} rooms={rooms} beds={len(bed_ids)}")
+        print(f"retained   {retained / 1024 / 1024:8.2f} MiB  ({retained / len(bed_ids):.0f} bytes/bed)")
+        print(f"peak       {peak / 1024 / 1024:8.2f} MiB")
+        print(f"load time  {elapsed * 1000:8.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
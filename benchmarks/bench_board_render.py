@@ -0,0 +1,70 @@
+"""
+ボード画面の表示用データの作成とテンプレート描画の時間
+
+    python benchmarks/bench_board_render.py [--rooms 60] [--beds 6] [--repeat 200]
+
+1エリア（--rooms 部屋 x --beds ベッド）について、表示用データの作成（DBからの読み込みを含む）と、
+board.html / display_board.html の描画（部屋カードのキャッシュなし・あり）にかかる時間を表示する
+"""
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+from common import setup_database, bench_user
+import config
+import services
+from models import db, Area
+
+def measure(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=60)
+    parser.add_argument('--beds', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'bench.db')
+        area_ids, _ = setup_database(path, areas=1, rooms_per_area=args.rooms, beds_per_room=args.beds)
+        import index
+        from bottle import jinja2_template as template
+        from fragment_cache import fragment_cache
+        index.create_app(path)
+        db.connect(reuse_if_open=True)
+        area = Area.get_by_id(area_ids[0])
+        user = bench_user()
+        rooms_data = services._load_board_data(area.id)
+
+        def render_board():
+            template('board.html', user=user, areas=[area], current_area=area, rooms_data=rooms_data,
+                     statuses=services.status_registry.active(), csrf_token='-', config=config,
+                     current_theme='light')
+
+        def render_display():
+            template('display_board.html', current_area=area, rooms_data=rooms_data, hidden_count=0,
+                     refresh_interval=config.DISPLAY_REFRESH_INTERVAL, push_enabled=False,
+                     now=datetime.datetime.now(), config=config, current_theme='light')
+
+        print(f"{'step':<40}{'ms':>10}")
+        print(f"{'load + view model':<40}{measure(lambda: services._load_board_data(area.id), args.repeat):>10.3f}")
+        for enabled in (False, True):
+            config.FRAGMENT_CACHE_ENABLED = enabled
+            fragment_cache.clear()
+            suffix = 'cached' if enabled else 'uncached'
+            print(f"{'render board.html (' + suffix + ')':<40}{measure(render_board, args.repeat):>10.3f}")
+            print(f"{'render display_board.html (' + suffix + ')':<40}{measure(render_display, args.repeat):>10.3f}")
+        db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
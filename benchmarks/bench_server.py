@@ -0,0 +1,123 @@
+"""
+常駐サーバー（serve.py）と CGI のスループット比較
+
+    python benchmarks/bench_server.py [--clients 8] [--seconds 5] [--path /display/board/1]
+
+同時に --clients 件ずつリクエストを送り続け、1秒あたりの処理件数と応答時間を表示する
+CGI はリクエストごとに index.py を新しいプロセスで実行して再現する
+"""
+import argparse
+import http.client
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import setup_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def load(request, clients, seconds):
+    """clients 個のスレッドで seconds 秒間 request() を繰り返し、応答時間（秒）のリストを返す"""
+    timings = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        local = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            request()
+            local.append(time.perf_counter() - start)
+        with lock:
+            timings.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return timings
+
+def report(name, timings, seconds):
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1000
+    p95 = timings[int(len(timings) * 0.95)] * 1000
+    print(f"{name:<28}{len(timings) / seconds:>10.1f}{p50:>10.1f}{p95:>10.1f}")
+
+def cgi_request(path, env):
+    def request():
+        result = subprocess.run([sys.executable, os.path.join(ROOT, 'index.py')], env=env,
+                                capture_output=True, check=True)
+        assert result.stdout.startswith(b'Status: 200'), result.stdout[:100]
+    return request
+
+def http_request(port, path):
+    def request():
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        assert response.status == 200, response.status
+    return request
+
+def wait_for_server(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--path', default='/display/board/1')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'bench.db')
+        setup_database(path)
+        env = dict(os.environ, WARDBOARD_DATABASE=path, SECRET_KEY='bench',
+                   REQUEST_METHOD='GET', PATH_INFO=args.path, QUERY_STRING='',
+                   SERVER_NAME='localhost', SERVER_PORT='80', SERVER_PROTOCOL='HTTP/1.1')
+
+        print(f"{'mode':<28}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        report('cgi', load(cgi_request(args.path, env), args.clients, args.seconds), args.seconds)
+
+        port = free_port()
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py'), '--host', '127.0.0.1',
+                                   '--port', str(port), '--processes', str(args.processes),
+                                   '--threads', str(args.threads), '--database', path],
+                                  cwd=workdir, env=dict(os.environ, SECRET_KEY='bench'),
+                                  stderr=subprocess.DEVNULL)
+        try:
+            wait_for_server(port)
+            request = http_request(port, args.path)
+            request()
+            name = f"serve.py {args.processes}p x {args.threads}t"
+            report(name, load(request, args.clients, args.seconds), args.seconds)
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
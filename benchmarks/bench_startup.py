@@ -0,0 +1,88 @@
+"""
+CGI 起動時間の計測（フェーズごとのミリ秒）
+
+    python benchmarks/bench_startup.py [--runs 5] [--path /display/board/1]
+
+CGI では1リクエストごとに新しいPythonプロセスが起動するため、毎回新しいプロセスで
+ライブラリの読み込みから最初のレスポンスまでを計測し、中央値を表示する
+（データベースは WARDBOARD_DATABASE で計測用のファイルを指定する）
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from common import setup_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子プロセスで実行する計測スクリプト
+PROBE = r'''
+import json, sys, time
+t0 = time.perf_counter()
+phases = []
+def mark(name):
+    global t0
+    now = time.perf_counter()
+    phases.append((name, (now - t0) * 1000))
+    t0 = now
+
+sys.path.insert(0, ROOT)
+import bottle, peewee, itsdangerous
+mark('import libraries')
+import config, models, auth, services, views_public
+mark('import app modules')
+import index
+app = index.application
+mark('import index (create_app)')
+
+def call(path):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '80', 'wsgi.url_scheme': 'http', 'wsgi.input': None,
+               'QUERY_STRING': '', 'SERVER_PROTOCOL': 'HTTP/1.1'}
+    status = []
+    body = b''.join(app(environ, lambda s, h, e=None: status.append(s)))
+    return status[0], len(body)
+
+call(PATH)
+mark('first request')
+call(PATH)
+mark('second request')
+print(json.dumps(phases))
+'''
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/display/board/1')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'bench.db')
+        setup_database(path)
+        probe = 'ROOT = %r\nPATH = %r\n' % (ROOT, args.path) + PROBE
+        env = dict(os.environ, WARDBOARD_DATABASE=path)
+
+        results = []
+        for _ in range(args.runs):
+            out = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True,
+                                 cwd=workdir, env=env, check=True).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+
+        total = []
+        print(f"{'phase':<28}{'median ms':>10}")
+        for i, (name, _) in enumerate(results[0]):
+            values = sorted(r[i][1] for r in results)
+            median = values[len(values) // 2]
+            total.append(median)
+            print(f"{name:<28}{median:>10.1f}")
+        print(f"{'total':<28}{sum(total[:-1]):>10.1f}  (second request 除く)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+状態変更1件あたりのSQL文の数と処理時間
+
+    python benchmarks/bench_state_update.py [--updates 2000]
+
+ベッド・部屋の状態をランダムに変更し、1件あたりの文の数（BEGIN / COMMIT を除く）と処理時間を表示する
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from common import setup_database, bench_user
+import services
+from models import db, Room, Status
+
+class StatementCounter:
+    """db.execute_sql を差し替え、発行された文を数える"""
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        original = db.execute_sql
+        def execute_sql(sql, *args, **kwargs):
+            self.count += 1
+            return original(sql, *args, **kwargs)
+        db.execute_sql = execute_sql
+        return self
+
+    def __exit__(self, *exc):
+        del db.execute_sql
+
+def run(name, update, target_ids, status_ids, user, updates):
+    timings = []
+    with StatementCounter() as counter:
+        for _ in range(updates):
+            start = time.perf_counter()
+            update(random.choice(target_ids), random.choice(status_ids), user)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1000
+    p95 = timings[int(len(timings) * 0.95)] * 1000
+    print(f"{name:<10}{counter.count / updates:>14.2f}{p50:>10.3f}{p95:>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        area_ids, bed_ids = setup_database(os.path.join(workdir, 'bench.db'))
+        db.connect(reuse_if_open=True)
+        status_ids = [s.id for s in Status.select()]
+        room_ids = [r.id for r in Room.select(Room.id)]
+        user = bench_user()
+
+        print(f"{'target':<10}{'statements':>14}{'p50 ms':>10}{'p95 ms':>10}")
+        run('bed', services.update_bed_state, bed_ids, status_ids, user, args.updates)
+        run('room', services.update_room_state, room_ids, status_ids, user, args.updates)
+        assert services.check_counters() == []
+        db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+ベンチマーク共通: リポジトリのモジュールを読み込めるようにし、ダミーの病院データを作成する
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import models
+from models import db, Area, Room, Bed, Status, RoomState, BedState, User
+
+ALL_MODELS = models.ALL_MODELS
+
+def setup_database(path, pragmas=None, areas=10, rooms_per_area=10, beds_per_room=4):
+    """
+    path にダミーの病院データを作成し、models.db をそのファイルで初期化する
+    戻り値: (エリアIDのリスト, ベッドIDのリスト)
+    """
+    db.init(path, pragmas=config.DATABASE_PRAGMAS if pragmas is None else pragmas)
+    db.connect(reuse_if_open=True)
+    db.create_tables(ALL_MODELS)
+    for s in config.INITIAL_STATUSES:
+        Status.get_or_create(key=s['key'], defaults=s)
+    vacant = Status.get(Status.key == 'vacant')
+
+    area_ids, bed_ids = [], []
+    with db.atomic():
+        for a in range(areas):
+            area = Area.create(name=f"Area{a}", sort_order=a)
+            area_ids.append(area.id)
+            for r in range(rooms_per_area):
+                room = Room.create(area=area, code=f"{a}-{r}", name=f"Room{a}-{r}", sort_order=r)
+                RoomState.create(room=room, status=vacant)
+                for b in range(beds_per_room):
+                    bed = Bed.create(room=room, code=f"{a}-{r}-{b}", name=f"Bed{b}", sort_order=b)
+                    BedState.create(bed=bed, status=vacant)
+                    bed_ids.append(bed.id)
+
+    import services
+    services.rebuild_counters()
+    db.close()
+    return area_ids, bed_ids
+
+def bench_user():
+    return User.get_or_create(username='bench', defaults={
+        'password_hash': '-', 'salt': '-', 'role': 'operator'})[0]
@@ -3,13 +3,53 @@ import secrets
 
 # 基本設定
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATABASE = os.path.join(BASE_DIR, 'ward_board.db')
+DATABASE = os.environ.get('WARDBOARD_DATABASE', os.path.join(BASE_DIR, 'ward_board.db'))
 DEBUG = True
 
+# SQLite の動作設定（接続ごとに PRAGMA として適用）
+# journal_mode=wal: 書き込み中も表示端末の読み込みをブロックしない（ネットワークドライブ上のDBでは使用しないこと）
+# 従来の動作に戻す場合は {} を指定
+DATABASE_PRAGMAS = {
+    # 削除で空いた領域をファイルから解放できるようにする（DBの新規作成時のみ有効。既存DBは manage.py vacuum で切り替え）
+    # ※journal_mode より先に設定する必要がある
+    'auto_vacuum': 'incremental',
+    'journal_mode': 'wal',
+    'synchronous': 'normal',  # WAL と組み合わせた場合、電源断でも破損はせず直前のコミットのみ失われ得る
+    'cache_size': -16000,  # 負数はKiB指定（約16MB）
+    'mmap_size': 64 * 1024 * 1024,
+    'busy_timeout': 5000,  # ミリ秒。他の書き込みの完了をこの時間まで待つ（書き込みトランザクションは BEGIN IMMEDIATE で開始する）
+    'temp_store': 'memory',
+}
+
+# テンプレートのコンパイル結果をファイルにキャッシュする（CGI では毎回のコンパイルを省略できる）
+# 保存先は一時ディレクトリ内のユーザーごとのディレクトリ
+TEMPLATE_BYTECODE_CACHE = True
+
+# 常駐サーバー（python serve.py）の設定
+# ボードのキャッシュ（BOARD_CACHE_ENABLED = None の場合）は1プロセスの場合のみ有効になる
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 8080
+SERVER_PROCESSES = 1
+SERVER_THREADS = 8
+# 表示端末のプッシュ更新（DISPLAY_PUSH_ENABLED）の同時接続数の上限
+# 接続はリクエスト用のスレッド（SERVER_THREADS）とは別のスレッドで保持する。超えた端末は定期再読み込みで表示する
+SERVER_STREAM_THREADS = 64
+# 停止・再起動時に処理中のリクエストの完了を待つ秒数
+SERVER_GRACEFUL_TIMEOUT = 30
+
+# 接続プール（常駐型のマルチスレッドサーバー向け。CGI では効果がないため False のまま）
+DATABASE_POOL = False
+DATABASE_POOL_MAX_CONNECTIONS = 8
+DATABASE_POOL_STALE_TIMEOUT = 300  # 秒。これより古い接続は再利用せずに開き直す
+
 # セキュリティ設定
 # 本番環境では環境変数などから固定の値を設定することを推奨
 SECRET_KEY = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 SESSION_NAME = 'ward_board_session'
+# セッションにロール情報を署名付きで保持し、この秒数の間はユーザーをDBから再取得しない（0で無効）
+# ユーザーの無効化・ロール変更は、他プロセスでは SESSION_CLAIM_CHECK_INTERVAL 秒以内に反映される
+SESSION_CLAIM_TTL = 0
+SESSION_CLAIM_CHECK_INTERVAL = 5  # 秒。claim の失効カウンタをDBで確認する間隔
 
 # 状態変更時の確認を有効にするか
 CONFIRM_STATE_CHANGE = True
@@ -17,8 +57,33 @@ CONFIRM_STATE_CHANGE = True
 # 表示専用モードの設定
 DISPLAY_REFRESH_INTERVAL = 30  # 秒
 
+# ボードデータのプロセス内キャッシュ
+# 状態変更・管理画面での変更時に無効化される（無効化は同じプロセス内にのみ伝わる）
+# None: serve.py を1プロセスで動かす場合のみ有効（CGI や他の WSGI サーバーでは無効）
+# True: 常に有効。1プロセスで動かす WSGI サーバー（複数プロセスにしない場合）でのみ指定すること
+BOARD_CACHE_ENABLED = None
+BOARD_CACHE_MAX_AREAS = 64  # 保持するエリア数の上限（LRU）
+
+# ボード画面の部屋カードの描画結果をキャッシュし、変更のない部屋は描画を省略する
+FRAGMENT_CACHE_ENABLED = True
+FRAGMENT_CACHE_MAX_ENTRIES = 4096  # 保持する部屋カードの数の上限（LRU）
+
+# 状態マスタ（Status）のプロセス内キャッシュ
+# 管理画面での変更は同じプロセスには即時、他のプロセスにはDBのバージョンを確認した時点で反映される
+STATUS_REGISTRY_CHECK_INTERVAL = 5  # 秒。DBのバージョンを確認する間隔
+
 # パスワードハッシュ設定
 HASH_ITERATIONS = 100000
+# 起動時にハッシュ1回あたりの所要時間を計測して表示する（`python manage.py calibrate-hash` でも確認可能）
+HASH_CALIBRATE_ON_STARTUP = False
+
+# ログイン時のパスワード検証
+LOGIN_VERIFY_WORKERS = 2  # 同時に実行する検証の数
+LOGIN_VERIFY_QUEUE = 16  # 検証待ちの上限（超えた場合は「混雑中」として再試行を促す）
+# ログイン失敗の抑止（DBに記録し、全プロセスで共有して計数する）
+LOGIN_FAILURE_WINDOW = 300  # 秒
+LOGIN_MAX_FAILURES = 5  # ユーザー名ごと
+LOGIN_MAX_FAILURES_PER_IP = 30  # 接続元IPごと（ナースステーション等の共用端末を考慮して多めに設定）
 
 # 初期データ設定
 INITIAL_STATUSES = [
@@ -30,6 +95,30 @@ INITIAL_STATUSES = [
 
 # ログ保持期間（0なら無制限）
 LOG_RETENTION_DAYS = 90
+# 変更履歴画面の1ページあたりの件数
+LOG_PAGE_SIZE = 100
+# 古いログの削除は LOG_PURGE_BATCH_SIZE 件ずつ行い、間に LOG_PURGE_PAUSE 秒休んで状態更新を待たせない
+LOG_PURGE_BATCH_SIZE = 1000
+LOG_PURGE_PAUSE = 0.05
+# 変更履歴の非同期書き込み（常駐サーバー向け。CGI では効果がないため False のまま）
+# 状態変更のリクエストでは履歴をスプールファイルに追記するだけにし、LOG_WRITE_BATCH_SIZE 件または
+# LOG_WRITE_INTERVAL 秒ごとにまとめてDBへ書き込む（異常終了時は次回起動時にスプールから復元）
+# 表示専用ボードのプッシュ更新・差分取得APIは履歴を元にするため、最大 LOG_WRITE_INTERVAL 秒遅れる
+LOG_WRITE_BEHIND = False
+LOG_WRITE_BATCH_SIZE = 200
+LOG_WRITE_INTERVAL = 1.0
+LOG_SPOOL_DIR = os.path.join(BASE_DIR, 'spool')
+LOG_SPOOL_FSYNC = False  # True: 追記ごとにディスクへ同期する（OSの停止にも備える代わりに遅くなる）
+
+# 古いログのアーカイブ（LOG_HOT_DAYS 日より古いログを別ファイルのDBに移動し、本体のDBを小さく保つ）
+# 変更履歴画面では、古いページを表示する場合のみアーカイブを参照する
+# アーカイブ内のログも LOG_RETENTION_DAYS を過ぎると削除されるため、長期保管する場合は大きな値にする
+LOG_ARCHIVE_ENABLED = False
+LOG_ARCHIVE_PATH = os.path.join(BASE_DIR, 'ward_board_archive.db')
+LOG_HOT_DAYS = 30
+# 常駐プロセスで古いログを自動削除（アーカイブ有効時は移動も）する間隔（秒。0で無効）
+# CGI の場合は cron 等から python manage.py purge-logs（アーカイブは archive-logs）を実行する
+LOG_PURGE_INTERVAL = 0
 
 # 集計設定 (v1.3)
 OCCUPIED_STATUS_KEYS = ["occupied"]
@@ -51,6 +140,11 @@ AUTO_RESET_RULES = {
 AUTO_RESET_SCOPE = "all" # "all" | "area"
 AUTO_RESET_AREAS = [] # scope="area" の時に対象とするArea IDのリスト
 AUTO_RESET_LOG_MODE = "summary" # "summary" | "per_item"
+# 実行方式
+#   "lazy":   アクセス時に判定して実行（CGI向け。実行済みの日はDBにアクセスしない）
+#   "thread": 常駐プロセス内のタイマースレッドで実行
+#   "cron":   アプリからは実行しない。cron 等から `python manage.py auto-reset` を実行する
+AUTO_RESET_MODE = "lazy"
 
 # 画面テーマ設定
 DEFAULT_THEME = "light" # "light" | "dark"
@@ -60,3 +154,12 @@ ALLOW_THEME_SWITCH = True
 DISPLAY_SHOW_UPDATED_AT = True
 DISPLAY_COMPACT = False
 DISPLAY_HIDE_EMPTY_ROOMS = False
+
+# 表示専用モードのプッシュ更新（Server-Sent Events）
+# 接続ごとにリクエストを保持し続けるため、CGI や単一スレッドのサーバーでは有効化しないこと
+# 固定数のスレッドで処理する WSGI サーバーでは、表示端末の数だけスレッドが占有され操作端末のリクエストが待たされる
+# serve.py では専用のスレッドで処理する（上限は SERVER_STREAM_THREADS）
+DISPLAY_PUSH_ENABLED = False
+DISPLAY_PUSH_POLL_INTERVAL = 1  # 秒（他プロセスでの変更を検出する間隔）
+DISPLAY_PUSH_HEARTBEAT = 15  # 秒（変更がない場合の生存確認の間隔）
+DISPLAY_PUSH_MAX_DURATION = 300  # 秒（1接続の最大保持時間。切断後はブラウザが自動で再接続する）
@@ -0,0 +1,77 @@
+"""
+テンプレートの部分キャッシュ（部屋カードなど、変更のない部分の描画結果を再利用する）
+
+    {% cache 'board_room', data.stamp, user.role %} ... {% endcache %}
+
+キーには表示内容を決める値（最終更新日時・テーマ・表示設定など）をすべて含める。
+キーが変われば描画し直すため、明示的な無効化は不要で、複数プロセスでもそのまま使える。
+"""
+import threading
+from collections import OrderedDict
+from jinja2 import nodes
+from jinja2.ext import Extension
+import config
+
+class FragmentCache:
+    """
+    描画済みのHTMLを保持するLRUキャッシュ
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+fragment_cache = FragmentCache(config.FRAGMENT_CACHE_MAX_ENTRIES)
+
+class FragmentCacheExtension(Extension):
+    """
+    {% cache キー1, キー2, ... %} ～ {% endcache %} で囲んだ部分の描画結果をキャッシュする
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(keys)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, keys, caller):
+        if not config.FRAGMENT_CACHE_ENABLED:
+            return caller()
+        key = tuple(keys)
+        html = fragment_cache.get(key)
+        if html is None:
+            html = caller()
+            fragment_cache.put(key, html)
+        return html
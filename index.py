@@ -6,8 +6,66 @@ from bottle import Bottle, run, static_file, redirect, TEMPLATE_PATH
 import config
 import models
 import auth
+import services
 import views_public
-import views_admin
+
+def admin_view(name):
+    """
+    管理画面のビューを初回呼び出し時に読み込む
+    CGI では公開画面のリクエストで管理画面のモジュールを読み込まずに済む
+    """
+    def view(*args, **kwargs):
+        import views_admin
+        return getattr(views_admin, name)(*args, **kwargs)
+    view.__name__ = name
+    return view
+
+def setup_template_cache():
+    # テンプレートのコンパイル結果をファイルに保存し、次のプロセスで再利用する
+    from bottle import Jinja2Template
+    if not config.TEMPLATE_BYTECODE_CACHE or 'bytecode_cache' in Jinja2Template.settings:
+        return
+    from jinja2 import FileSystemBytecodeCache
+    try:
+        # settings は他のテンプレートクラスと共有の辞書なので Jinja2 用に複製する
+        Jinja2Template.settings = dict(Jinja2Template.settings, bytecode_cache=FileSystemBytecodeCache())
+    except (OSError, RuntimeError):
+        # 一時ディレクトリが使えない環境ではキャッシュなしで動作する
+        pass
+
+def setup_template_extensions():
+    # {% cache %} タグ（部屋カードなどの部分キャッシュ）を使えるようにする
+    from bottle import Jinja2Template
+    from fragment_cache import FragmentCacheExtension
+    extensions = list(Jinja2Template.settings.get('extensions', []))
+    if FragmentCacheExtension not in extensions:
+        Jinja2Template.settings = dict(Jinja2Template.settings, extensions=extensions + [FragmentCacheExtension])
+
+def warm_up():
+    """
+    常駐サーバーのワーカー起動時に、テンプレートのコンパイルとボードのキャッシュを済ませておく
+    """
+    from bottle import Jinja2Template, TEMPLATES
+    from jinja2 import meta
+    # 常駐時はテンプレートを毎回読み直さない（変更の反映はサーバーの再起動で行う）
+    Jinja2Template.settings = dict(Jinja2Template.settings, auto_reload=False)
+    template_dir = os.path.join(config.BASE_DIR, 'templates')
+    for dirpath, _, filenames in os.walk(template_dir):
+        for filename in filenames:
+            if not filename.endswith('.html'):
+                continue
+            name = os.path.relpath(os.path.join(dirpath, filename), template_dir).replace(os.sep, '/')
+            tpl = Jinja2Template(name=name, lookup=TEMPLATE_PATH)
+            # extends/include される base.html なども各テンプレートの環境で読み込んでおく
+            source = tpl.env.loader.get_source(tpl.env, name)[0]
+            for ref in meta.find_referenced_templates(tpl.env.parse(source)):
+                if ref:
+                    tpl.env.get_template(ref)
+            TEMPLATES[(id(TEMPLATE_PATH), name)] = tpl
+
+    with models.db.connection_context():
+        for area in models.Area.select(models.Area.id).where(models.Area.is_active == True):
+            services.get_board_data(area.id)
 
 def create_app(database_path=None):
     models.init_db(database_path)
@@ -16,9 +74,21 @@ def create_app(database_path=None):
         TEMPLATE_PATH.insert(0, config.BASE_DIR)
     if os.path.join(config.BASE_DIR, 'templates') not in TEMPLATE_PATH:
         TEMPLATE_PATH.insert(0, os.path.join(config.BASE_DIR, 'templates'))
+    setup_template_cache()
+    setup_template_extensions()
     
     app = Bottle()
 
+    if config.HASH_CALIBRATE_ON_STARTUP:
+        print(f"password hash: {config.HASH_ITERATIONS} iterations = {auth.calibrate_hash():.1f} ms", file=sys.stderr)
+
+    if config.AUTO_RESET_ENABLED and config.AUTO_RESET_MODE == 'thread':
+        services.start_auto_reset_scheduler()
+    if config.LOG_WRITE_BEHIND:
+        services.start_log_writer()
+    if config.LOG_PURGE_INTERVAL > 0:
+        services.start_log_purge_scheduler()
+
     # 静的ファイルの配信
     @app.get('/static/<path:path>')
     def server_static(path):
@@ -32,6 +102,10 @@ def create_app(database_path=None):
             "status": "OK"
         }
 
+    # リクエストごとに接続を開き、終了時に閉じる（接続プール使用時は返却）
+    app.add_hook('before_request', models.open_connection)
+    app.add_hook('after_request', models.close_connection)
+
     # ルーティングの統合
     app.add_hook('before_request', views_public.before_request)
     app.route('/login', 'GET', views_public.login_page)
@@ -42,51 +116,54 @@ def create_app(database_path=None):
     app.route('/board/<area_id:int>', 'GET', views_public.board_page)
     app.route('/state/room/<room_id:int>', 'POST', views_public.update_room_state_handler)
     app.route('/state/bed/<bed_id:int>', 'POST', views_public.update_bed_state_handler)
+    app.route('/state/bulk', 'POST', views_public.update_states_bulk_handler)
     app.route('/summary', 'GET', views_public.summary_page)
     app.route('/summary/<area_id:int>', 'GET', views_public.summary_page)
     app.route('/install', 'GET', views_public.install_page)
     app.route('/install', 'POST', views_public.install_handler)
 
     # 管理画面の統合
-    app.get('/admin')(views_admin.admin_index)
-    app.get('/admin/areas')(views_admin.admin_areas)
-    app.get('/admin/areas/new')(views_admin.admin_areas_new)
-    app.post('/admin/areas/new')(views_admin.admin_areas_create)
-    app.get('/admin/areas/<id:int>/edit')(views_admin.admin_areas_edit)
-    app.post('/admin/areas/<id:int>/edit')(views_admin.admin_areas_update)
-    app.post('/admin/areas/<id:int>/toggle_active')(views_admin.admin_areas_toggle)
-
-    app.get('/admin/rooms')(views_admin.admin_rooms)
-    app.get('/admin/rooms/new')(views_admin.admin_rooms_new)
-    app.post('/admin/rooms/new')(views_admin.admin_rooms_create)
-    app.get('/admin/rooms/<id:int>/edit')(views_admin.admin_rooms_edit)
-    app.post('/admin/rooms/<id:int>/edit')(views_admin.admin_rooms_update)
-    app.post('/admin/rooms/<id:int>/toggle_active')(views_admin.admin_rooms_toggle)
-
-    app.get('/admin/beds')(views_admin.admin_beds)
-    app.get('/admin/beds/new')(views_admin.admin_beds_new)
-    app.post('/admin/beds/new')(views_admin.admin_beds_create)
-    app.get('/admin/beds/<id:int>/edit')(views_admin.admin_beds_edit)
-    app.post('/admin/beds/<id:int>/edit')(views_admin.admin_beds_update)
-    app.post('/admin/beds/<id:int>/toggle_active')(views_admin.admin_beds_toggle)
-
-    app.get('/admin/statuses')(views_admin.admin_statuses)
-    app.get('/admin/statuses/new')(views_admin.admin_statuses_new)
-    app.post('/admin/statuses/new')(views_admin.admin_statuses_create)
-    app.get('/admin/statuses/<id:int>/edit')(views_admin.admin_statuses_edit)
-    app.post('/admin/statuses/<id:int>/edit')(views_admin.admin_statuses_update)
-
-    app.get('/admin/users')(views_admin.admin_users)
-    app.get('/admin/users/new')(views_admin.admin_users_new)
-    app.post('/admin/users/new')(views_admin.admin_users_create)
-    app.get('/admin/users/<id:int>/edit')(views_admin.admin_users_edit)
-    app.post('/admin/users/<id:int>/edit')(views_admin.admin_users_update)
-    app.post('/admin/users/<id:int>/toggle_active')(views_admin.admin_users_toggle)
+    app.get('/admin')(admin_view('admin_index'))
+    app.get('/admin/areas')(admin_view('admin_areas'))
+    app.get('/admin/areas/new')(admin_view('admin_areas_new'))
+    app.post('/admin/areas/new')(admin_view('admin_areas_create'))
+    app.get('/admin/areas/<id:int>/edit')(admin_view('admin_areas_edit'))
+    app.post('/admin/areas/<id:int>/edit')(admin_view('admin_areas_update'))
+    app.post('/admin/areas/<id:int>/toggle_active')(admin_view('admin_areas_toggle'))
+
+    app.get('/admin/rooms')(admin_view('admin_rooms'))
+    app.get('/admin/rooms/new')(admin_view('admin_rooms_new'))
+    app.post('/admin/rooms/new')(admin_view('admin_rooms_create'))
+    app.get('/admin/rooms/<id:int>/edit')(admin_view('admin_rooms_edit'))
+    app.post('/admin/rooms/<id:int>/edit')(admin_view('admin_rooms_update'))
+    app.post('/admin/rooms/<id:int>/toggle_active')(admin_view('admin_rooms_toggle'))
+
+    app.get('/admin/beds')(admin_view('admin_beds'))
+    app.get('/admin/beds/new')(admin_view('admin_beds_new'))
+    app.post('/admin/beds/new')(admin_view('admin_beds_create'))
+    app.get('/admin/beds/<id:int>/edit')(admin_view('admin_beds_edit'))
+    app.post('/admin/beds/<id:int>/edit')(admin_view('admin_beds_update'))
+    app.post('/admin/beds/<id:int>/toggle_active')(admin_view('admin_beds_toggle'))
+
+    app.get('/admin/statuses')(admin_view('admin_statuses'))
+    app.get('/admin/statuses/new')(admin_view('admin_statuses_new'))
+    app.post('/admin/statuses/new')(admin_view('admin_statuses_create'))
+    app.get('/admin/statuses/<id:int>/edit')(admin_view('admin_statuses_edit'))
+    app.post('/admin/statuses/<id:int>/edit')(admin_view('admin_statuses_update'))
+
+    app.get('/admin/users')(admin_view('admin_users'))
+    app.get('/admin/users/new')(admin_view('admin_users_new'))
+    app.post('/admin/users/new')(admin_view('admin_users_create'))
+    app.get('/admin/users/<id:int>/edit')(admin_view('admin_users_edit'))
+    app.post('/admin/users/<id:int>/edit')(admin_view('admin_users_update'))
+    app.post('/admin/users/<id:int>/toggle_active')(admin_view('admin_users_toggle'))
     
-    app.get('/admin/logs')(views_admin.admin_logs)
-    app.post('/admin/logs/purge')(views_admin.admin_logs_purge)
+    app.get('/admin/logs')(admin_view('admin_logs'))
+    app.post('/admin/logs/purge')(admin_view('admin_logs_purge'))
     
     app.get('/display/board/<area_id:int>')(views_public.display_board_page)
+    app.get('/display/board/<area_id:int>/events')(views_public.display_board_events)
+    app.get('/api/board/<area_id:int>/changes')(views_public.board_changes_api)
     app.get('/theme/<theme_name>')(views_public.switch_theme_handler)
     
     return app
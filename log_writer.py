@@ -0,0 +1,191 @@
+"""
+変更履歴の非同期書き込み（write-behind。config.LOG_WRITE_BEHIND = True の場合に使用）
+
+状態変更のリクエストでは履歴をキューとスプールファイルに追加するだけにし、
+バックグラウンドのスレッドが一定件数・一定時間ごとに insert_many でまとめて書き込む。
+DBに書き込む前にプロセスが異常終了しても、次回起動時にスプールファイルから復元する。
+"""
+import datetime
+import glob
+import json
+import os
+import sys
+import threading
+import traceback
+from models import db, StateChangeLog
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # fork のない環境では1プロセスで動作するため、他のスプールは前回起動時のもの
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _encode(row):
+    row = dict(row)
+    row['changed_at'] = row['changed_at'].isoformat()
+    return json.dumps(row, ensure_ascii=False)
+
+def _decode(line):
+    row = json.loads(line)
+    row['changed_at'] = datetime.datetime.fromisoformat(row['changed_at'])
+    return row
+
+class LogWriter:
+    """
+    履歴をまとめて書き込むキュー
+    スプールファイル: <spool_dir>/changelog-<pid>.jsonl（追加中）、changelog-<pid>.<連番>.jsonl（書き込み中）
+    """
+    def __init__(self, spool_dir, batch_size=200, interval=1.0, fsync=False, on_flush=None):
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.interval = interval
+        self.fsync = fsync
+        self.on_flush = on_flush
+        self._lock = threading.Lock()        # キューとスプールへの追加
+        self._flush_lock = threading.Lock()  # 書き込みは同時に1つだけ
+        self._wake = threading.Event()
+        self._queue = []
+        self._pending = []  # 書き込みに失敗し、再試行待ちの (スプールファイル, 行のリスト)
+        self._spool = None
+        self._seq = 0
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def spool_path(self):
+        return os.path.join(self.spool_dir, f'changelog-{os.getpid()}.jsonl')
+
+    def start(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.recover()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, row):
+        with self._lock:
+            if self._spool is None:
+                os.makedirs(self.spool_dir, exist_ok=True)
+                self._spool = open(self.spool_path, 'a', encoding='utf-8')
+            self._spool.write(_encode(row) + '\n')
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            self._queue.append(row)
+            if len(self._queue) >= self.batch_size:
+                self._wake.set()
+
+    def flush(self):
+        """
+        キューの履歴をDBに書き込む
+        戻り値: 書き込んだ件数
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._queue:
+                    # 書き込み中の分を別ファイルに切り出し、以降の追加は新しいスプールへ
+                    self._spool.close()
+                    self._spool = None
+                    self._seq += 1
+                    sealed = os.path.join(self.spool_dir, f'changelog-{os.getpid()}.{self._seq}.jsonl')
+                    os.replace(self.spool_path, sealed)
+                    self._pending.append((sealed, self._queue))
+                    self._queue = []
+
+            written = 0
+            while self._pending:
+                sealed, rows = self._pending[0]
+                self._insert(rows)
+                os.remove(sealed)
+                self._pending.pop(0)
+                written += len(rows)
+        if written and self.on_flush:
+            self.on_flush()
+        return written
+
+    def stop(self):
+        """
+        スレッドを止め、残りの履歴を書き込む（終了時に呼ぶ）
+        """
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with db.connection_context():
+            self.flush()
+
+    def recover(self):
+        """
+        終了済みのプロセスが残したスプールファイルの履歴を書き込む
+        書き込み済みの行（同じ日時・対象・変更後の状態）は除外するため、何度実行しても重複しない
+        戻り値: 復元した件数
+        """
+        recovered = 0
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, 'changelog-*.jsonl'))):
+            pid = os.path.basename(path).split('-', 1)[1].split('.', 1)[0]
+            if not pid.isdigit() or _pid_alive(int(pid)):
+                continue
+            # 複数のワーカーが同時に起動しても1つだけが復元するよう、自分のPIDの名前に変えてから読む
+            # （復元中に終了した場合は、このファイルが次回の起動時に復元される）
+            self._seq += 1
+            claimed = os.path.join(self.spool_dir, f'changelog-{os.getpid()}.recover{self._seq}.jsonl')
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue  # 他のワーカーが復元済み
+            with open(claimed, encoding='utf-8') as f:
+                # 書き込み途中で終了した最後の行は読み飛ばす
+                rows = []
+                for line in f:
+                    try:
+                        rows.append(_decode(line))
+                    except ValueError:
+                        continue
+            with db.connection_context():
+                # 書き込み済みかの確認と追加を同じ書き込みトランザクションで行う
+                with db.atomic('IMMEDIATE'):
+                    rows = [row for row in rows if not self._exists(row)]
+                    self._insert(rows)
+            try:
+                os.remove(claimed)
+            except FileNotFoundError:
+                pass
+            recovered += len(rows)
+        if recovered:
+            print(f"log writer: recovered {recovered} rows from spool", file=sys.stderr)
+        return recovered
+
+    def _exists(self, row):
+        return (StateChangeLog.select()
+                .where(StateChangeLog.changed_at == row['changed_at'],
+                       StateChangeLog.target_type == row['target_type'],
+                       StateChangeLog.room == row['room'],
+                       StateChangeLog.bed == row['bed'],
+                       StateChangeLog.to_status == row['to_status'])
+                .exists())
+
+    def _insert(self, rows):
+        if not rows:
+            return
+        with db.atomic('IMMEDIATE'):
+            for start in range(0, len(rows), 100):
+                StateChangeLog.insert_many(rows[start:start + 100]).execute()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with db.connection_context():
+                    self.flush()
+            except Exception:
+                # 書き込めなかった分はスプールに残り、次回に再試行する
+                traceback.print_exc()
@@ -0,0 +1,99 @@
+#!/usr/local/bin/python3
+"""
+運用タスク用のコマンドラインツール
+
+    python manage.py auto-reset          # 日付切替の自動リセット（cron から実行）
+    python manage.py rebuild-counters    # 集計カウンタの再構築
+    python manage.py check-counters      # 集計カウンタの整合性確認
+    python manage.py calibrate-hash      # パスワードハッシュの所要時間の計測
+    python manage.py purge-logs          # 保持期間より古い変更履歴の削除（cron から実行）
+    python manage.py archive-logs        # 古い変更履歴のアーカイブへの移動（cron から実行）
+    python manage.py vacuum              # DBの最適化（既存DBの空き領域の自動解放を有効にする）
+"""
+import argparse
+import sys
+import auth
+import config
+import models
+import services
+
+def cmd_auto_reset(args):
+    if not config.AUTO_RESET_ENABLED:
+        print("AUTO_RESET_ENABLED が無効のため実行しません。")
+        return 1
+    services.maybe_run_auto_reset()
+    return 0
+
+def cmd_rebuild_counters(args):
+    services.rebuild_counters()
+    print("集計カウンタを再構築しました。")
+    return 0
+
+def cmd_check_counters(args):
+    drift = services.check_counters()
+    for d in drift:
+        print(f"area={d['area_id']} status={d['status_id']} available={d['is_available']}: "
+              f"expected={d['expected']} actual={d['actual']}")
+    if drift:
+        print(f"{len(drift)}件のずれがあります。rebuild-counters で修復できます。")
+        return 1
+    print("集計カウンタは整合しています。")
+    return 0
+
+def cmd_calibrate_hash(args):
+    elapsed = auth.calibrate_hash()
+    per_second = 1000 / elapsed * config.LOGIN_VERIFY_WORKERS if elapsed else 0
+    print(f"HASH_ITERATIONS={config.HASH_ITERATIONS}: {elapsed:.1f} ms / 回")
+    print(f"LOGIN_VERIFY_WORKERS={config.LOGIN_VERIFY_WORKERS}: 最大 約{per_second:.1f} 件/秒")
+    if args.target_ms:
+        suggested = int(config.HASH_ITERATIONS * args.target_ms / elapsed)
+        print(f"目標 {args.target_ms} ms に対する HASH_ITERATIONS の目安: {suggested}")
+    return 0
+
+def cmd_purge_logs(args):
+    if config.LOG_RETENTION_DAYS <= 0:
+        print("LOG_RETENTION_DAYS が 0（無制限）のため実行しません。")
+        return 1
+    result = services.purge_logs()
+    print(f"{result['rows']}件のログを削除し、{result['pages']}ページを解放しました。")
+    return 0
+
+def cmd_archive_logs(args):
+    if not config.LOG_ARCHIVE_ENABLED:
+        print("LOG_ARCHIVE_ENABLED が無効のため実行しません。")
+        return 1
+    result = services.archive_logs()
+    print(f"{result['rows']}件のログをアーカイブに移動し、{result['pages']}ページを解放しました。")
+    return 0
+
+def cmd_vacuum(args):
+    # auto_vacuum の変更は VACUUM で反映される（実行中はDBへの書き込みが待たされる）
+    before = models.db.pragma('page_count')
+    models.db.pragma('auto_vacuum', 'incremental')
+    models.db.execute_sql('VACUUM')
+    print(f"VACUUM を実行しました（{before} → {models.db.pragma('page_count')} ページ）。")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WardBoard-OSS 運用タスク")
+    parser.add_argument('--database', help="データベースファイル（省略時は config.DATABASE）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('auto-reset', help="日付切替の自動リセット").set_defaults(func=cmd_auto_reset)
+    subparsers.add_parser('rebuild-counters', help="集計カウンタの再構築").set_defaults(func=cmd_rebuild_counters)
+    subparsers.add_parser('check-counters', help="集計カウンタの整合性確認").set_defaults(func=cmd_check_counters)
+    subparsers.add_parser('purge-logs', help="古い変更履歴の削除").set_defaults(func=cmd_purge_logs)
+    subparsers.add_parser('archive-logs', help="古い変更履歴のアーカイブ").set_defaults(func=cmd_archive_logs)
+    subparsers.add_parser('vacuum', help="DBの最適化").set_defaults(func=cmd_vacuum)
+    calibrate = subparsers.add_parser('calibrate-hash', help="パスワードハッシュの所要時間の計測")
+    calibrate.add_argument('--target-ms', type=float, help="1回あたりの目標時間（ミリ秒）")
+    calibrate.set_defaults(func=cmd_calibrate_hash, skip_db=True)
+    args = parser.parse_args(argv)
+
+    if getattr(args, 'skip_db', False):
+        return args.func(args)
+    models.init_db(args.database)
+    with models.db.connection_context():
+        return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
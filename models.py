@@ -2,7 +2,27 @@ from peewee import *
 import datetime
 import config
 
-db = SqliteDatabase(None)
+def make_database():
+    # 常駐型のマルチスレッドサーバーでは接続プールを使うと接続を再利用できる
+    if config.DATABASE_POOL:
+        from playhouse.pool import PooledSqliteDatabase
+        return PooledSqliteDatabase(None,
+                                    max_connections=config.DATABASE_POOL_MAX_CONNECTIONS,
+                                    stale_timeout=config.DATABASE_POOL_STALE_TIMEOUT)
+    return SqliteDatabase(None)
+
+db = make_database()
+
+def open_connection():
+    db.connect(reuse_if_open=True)
+
+def close_connection():
+    # 接続プール使用時はプールに返却される
+    if not db.is_closed():
+        db.close()
+
+# 変更履歴のアーカイブDBを ATTACH する際のスキーマ名
+ARCHIVE_SCHEMA = 'archive'
 
 class BaseModel(Model):
     created_at = DateTimeField(default=datetime.datetime.now)
@@ -68,28 +88,129 @@ class StateChangeLog(BaseModel):
     target_type = CharField()  # 'room' or 'bed'
     room = ForeignKeyField(Room, null=True, backref='logs')
     bed = ForeignKeyField(Bed, null=True, backref='logs')
-    area = ForeignKeyField(Area, null=True, backref='logs')
+    area = ForeignKeyField(Area, null=True, backref='logs', index=False)
     from_status = ForeignKeyField(Status, null=True, related_name='logs_from')
     to_status = ForeignKeyField(Status, null=True, related_name='logs_to')
-    changed_by = ForeignKeyField(User, null=True)
-    changed_at = DateTimeField(default=datetime.datetime.now)
+    changed_by = ForeignKeyField(User, null=True, index=False)
+    changed_at = DateTimeField(default=datetime.datetime.now, index=True)
     note = TextField(null=True)
     meta = TextField(null=True)
 
+    class Meta:
+        # 履歴画面の絞り込み（エリア・対象・変更者）と新しい順の並び替えを1つのインデックスで行う
+        # area, changed_by の単独インデックスはこれらの先頭列で代用する
+        indexes = (
+            (('area', 'changed_at'), False),
+            (('target_type', 'changed_at'), False),
+            (('changed_by', 'changed_at'), False),
+        )
+
+class ArchivedStateChangeLog(BaseModel):
+    # 古い変更履歴の保管先（別ファイルのDBを ATTACH して使用する。LOG_ARCHIVE_ENABLED 時のみ）
+    # 別DBのテーブルは参照できないため、関連は外部キーではなくIDのみで保持する
+    id = IntegerField(primary_key=True)  # 元の StateChangeLog.id
+    target_type = CharField()
+    room = IntegerField(null=True, column_name='room_id')
+    bed = IntegerField(null=True, column_name='bed_id')
+    area = IntegerField(null=True, column_name='area_id')
+    from_status = IntegerField(null=True, column_name='from_status_id')
+    to_status = IntegerField(null=True, column_name='to_status_id')
+    changed_by = IntegerField(null=True, column_name='changed_by_id')
+    changed_at = DateTimeField(index=True)
+    note = TextField(null=True)
+    meta = TextField(null=True)
+
+    class Meta:
+        schema = ARCHIVE_SCHEMA
+        table_name = 'statechangelog'
+        indexes = (
+            (('area', 'changed_at'), False),
+            (('target_type', 'changed_at'), False),
+            (('changed_by', 'changed_at'), False),
+        )
+
+class OccupancyCounter(BaseModel):
+    # エリア x 状態 x 運用可否 ごとのアクティブなベッド数（/summary 用の増分カウンタ）
+    area = ForeignKeyField(Area, backref='counters')
+    status_id = IntegerField(default=0)  # Status.id（0 は状態未設定）
+    is_available = BooleanField(default=True)
+    bed_count = IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            (('area', 'status_id', 'is_available'), True),
+        )
+
 class SystemJobState(BaseModel):
     job_key = CharField(unique=True)
     last_run_at = DateTimeField(null=True)
     last_run_date = DateField(null=True)
 
+class CacheVersion(BaseModel):
+    """
+    プロセス内キャッシュのバージョン（変更時に加算し、他のプロセスのキャッシュを無効化する）
+    """
+    key = CharField(unique=True)
+    version = IntegerField(default=0)
+
+class LoginFailure(Model):
+    """
+    ログイン失敗の記録（ユーザー名・接続元IPごとの試行回数の制限に使う。全プロセスで共有する）
+    LOGIN_FAILURE_WINDOW より古い行は失敗の記録時に削除する
+    """
+    kind = CharField()  # 'user' / 'ip'
+    value = CharField()
+    failed_at = DateTimeField(default=datetime.datetime.now, index=True)
+
+    class Meta:
+        database = db
+        indexes = (
+            (('kind', 'value', 'failed_at'), False),
+        )
+
+ALL_MODELS = [User, Area, Room, Bed, Status, RoomState, BedState, StateChangeLog, SystemJobState, OccupancyCounter, CacheVersion, LoginFailure]
+
 def init_db(database_path=None):
-    import auth
+    # 接続プールに別ファイルへの接続が残らないようにする
+    if hasattr(db, 'close_all'):
+        db.close_all()
     if database_path:
-        db.init(database_path)
+        db.init(database_path, pragmas=config.DATABASE_PRAGMAS)
     else:
-        db.init(config.DATABASE)
+        db.init(config.DATABASE, pragmas=config.DATABASE_PRAGMAS)
+    # アーカイブDBは接続ごとに ATTACH される
+    db.detach(ARCHIVE_SCHEMA)
+    if config.LOG_ARCHIVE_ENABLED:
+        db.attach(config.LOG_ARCHIVE_PATH, ARCHIVE_SCHEMA)
         
     db.connect(reuse_if_open=True)
-    db.create_tables([User, Area, Room, Bed, Status, RoomState, BedState, StateChangeLog, SystemJobState])
+    if db.pragma('user_version') < SCHEMA_VERSION:
+        # 複数のプロセスが同時に起動しても1回だけ実行されるよう、書き込みロックを取ってから再確認する
+        with db.atomic('IMMEDIATE'):
+            migrate()
+    if config.LOG_ARCHIVE_ENABLED and not ArchivedStateChangeLog.table_exists():
+        with db.atomic('IMMEDIATE'):
+            ArchivedStateChangeLog.create_table()
+    db.close()
+
+def migrate():
+    """
+    未適用のマイグレーションを順に実行し、適用済みのバージョンを PRAGMA user_version に記録する
+    """
+    version = db.pragma('user_version')
+    for target, migration in enumerate(MIGRATIONS, 1):
+        if version < target:
+            migration()
+            db.pragma('user_version', target)
+
+def setup_schema():
+    counters_missing = not OccupancyCounter.table_exists()
+    db.create_tables(ALL_MODELS)
+
+    # 集計カウンタが新規作成された場合は既存データから構築
+    if counters_missing:
+        import services
+        services.rebuild_counters()
     
     # 初期ステータスの投入
     if Status.select().count() == 0:
@@ -98,7 +219,7 @@ def init_db(database_path=None):
             
     # 初期管理者の投入
     if User.select().where(User.role == 'admin').count() == 0:
-        # 循環参照を避けるために init_db 内でインポート
+        # 循環参照を避けるために関数内でインポート
         from auth import hash_password
         password_hash, salt = hash_password(config.DEFAULT_ADMIN_PASSWORD)
         User.create(
@@ -107,5 +228,26 @@ def init_db(database_path=None):
             salt=salt,
             role='admin'
         )
-        
-    db.close()
+
+def add_log_indexes():
+    # 変更履歴の複合インデックスを作成し、代用できる単独インデックスを削除する
+    StateChangeLog._schema.create_indexes(safe=True)
+    db.execute_sql('DROP INDEX IF EXISTS "statechangelog_area_id"')
+    db.execute_sql('DROP INDEX IF EXISTS "statechangelog_changed_by_id"')
+
+def add_cache_versions():
+    db.create_tables([CacheVersion])
+
+def add_login_failures():
+    db.create_tables([LoginFailure])
+
+# マイグレーション（n 番目の関数がスキーマバージョン n に更新する）
+# 新規のDBでも先頭から順に実行されるため、各関数は適用済みの状態で実行しても問題ないようにする
+# 変更を加える場合は末尾に追加し、既存の項目は変更しない
+MIGRATIONS = [
+    setup_schema,        # 1: テーブル作成・初期データ
+    add_log_indexes,     # 2: 変更履歴のインデックス
+    add_cache_versions,  # 3: プロセス内キャッシュのバージョン
+    add_login_failures,  # 4: ログイン失敗の記録
+]
+SCHEMA_VERSION = len(MIGRATIONS)
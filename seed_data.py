@@ -1,7 +1,8 @@
 import datetime
 import random
-from models import db, User, Area, Room, Bed, Status, RoomState, BedState, init_db
+from models import db, User, Area, Room, Bed, Status, RoomState, BedState, OccupancyCounter, init_db
 import config
+import services
 
 def seed():
     print("Initializing database...")
@@ -16,6 +17,7 @@ def seed():
         if confirm.lower() == 'y':
             print("Clearing existing data...")
             # 外部キー制約を考慮して削除
+            OccupancyCounter.delete().execute()
             StateChangeLog.delete().execute()
             BedState.delete().execute()
             RoomState.delete().execute()
@@ -85,6 +87,9 @@ def seed():
                     updated_at=None # 初期状態は「---」にするため
                 )
     
+    # 直接投入したベッドを集計カウンタに反映
+    services.rebuild_counters()
+
     print("Done! Dummy data has been successfully inserted.")
     db.close()
 
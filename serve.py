@@ -0,0 +1,254 @@
+#!/usr/local/bin/python3
+"""
+常駐型のマルチワーカーサーバー（CGI の代わりに使う本番用の起動方法）
+
+    python serve.py [--host 0.0.0.0] [--port 8080] [--processes 1] [--threads 8]
+
+- 各ワーカーは起動時に create_app() を1回だけ実行し、テンプレートのコンパイルとボードのキャッシュを済ませる
+- リクエストは各ワーカーのスレッドプール（--threads）で処理する
+  表示端末のプッシュ更新（/events）は接続を保持し続けるため、プールとは別のスレッドで処理する
+  （同時接続数の上限は config.SERVER_STREAM_THREADS。超えた接続には 503 を返し、端末は定期再読み込みになる）
+- SIGHUP: 新しいワーカーを起動してから古いワーカーを停止する（処理中のリクエストは完了させる）
+  config.py やプログラムの変更はこの再起動で反映される
+- SIGTERM / SIGINT: 処理中のリクエストを完了させてから終了する
+- fork が使えない環境（Windows）では1プロセスで動作し、SIGHUP による再起動は使えない
+"""
+import argparse
+import importlib
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+import config
+
+class RequestHandler(WSGIRequestHandler):
+    # 応答しないクライアントがスレッドを占有し続けないようにする
+    timeout = 60
+    access_log = False
+
+    def log_message(self, format, *args):
+        if self.access_log:
+            super().log_message(format, *args)
+
+class PoolWSGIServer(WSGIServer):
+    """
+    作成済みの待ち受けソケットで、リクエストを固定数のスレッドで処理する WSGI サーバー
+    イベントストリームはプールのスレッドを占有しないよう、上限（stream_threads）までは専用のスレッドで処理する
+    """
+    def __init__(self, sock, threads, stream_threads=0, handler=RequestHandler):
+        super().__init__(sock.getsockname()[:2], handler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_name, self.server_port = sock.getsockname()[:2]
+        self.setup_environ()
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.streams = threading.BoundedSemaphore(stream_threads) if stream_threads else None
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.dispatch_request, request, client_address)
+
+    def dispatch_request(self, request, client_address):
+        if self.streams is None or not self.is_event_stream(request):
+            self.process_request_thread(request, client_address)
+        elif self.streams.acquire(blocking=False):
+            # ストリームは再接続されるため、停止時に終了を待たない
+            threading.Thread(target=self.process_stream_thread, args=(request, client_address),
+                             daemon=True).start()
+        else:
+            # 上限を超えた場合はプールで処理せずに断る（操作端末のリクエストを待たせない）
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\nRetry-After: 30\r\n'
+                                b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def is_event_stream(self, request):
+        # リクエスト行を読み進めずに確認する（読み込みはハンドラーが行う）
+        request.settimeout(RequestHandler.timeout)
+        try:
+            head = request.recv(1024, socket.MSG_PEEK)
+        except OSError:
+            return False
+        parts = head.split(b'\r\n', 1)[0].split(b' ')
+        return len(parts) == 3 and parts[0] == b'GET' and parts[1].split(b'?', 1)[0].endswith(b'/events')
+
+    def process_stream_thread(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self.streams.release()
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        # 処理中のリクエストを完了させてから閉じる
+        self.executor.shutdown(wait=True)
+        super().server_close()
+
+def create_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    return sock
+
+def run_worker(sock, threads, overrides):
+    # SIGHUP での再起動時に config.py の変更を反映する（起動時の指定は引き継ぐ）
+    importlib.reload(config)
+    for name, value in overrides.items():
+        setattr(config, name, value)
+
+    import index
+    import services
+    index.warm_up()
+    server = PoolWSGIServer(sock, threads, config.SERVER_STREAM_THREADS)
+    server.set_app(index.application)
+
+    def stop(signum, frame):
+        # serve_forever と同じスレッドからは shutdown できないため別スレッドで呼ぶ
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        # ワーカーは os._exit で終了するため、未書き込みの履歴はここで書き込む
+        services.stop_log_writer()
+
+class Master:
+    """
+    ワーカープロセスの起動・監視・再起動を行う
+    """
+    def __init__(self, sock, processes, threads, overrides):
+        self.sock = sock
+        self.processes = processes
+        self.threads = threads
+        self.overrides = overrides
+        self.workers = set()
+        self.retiring = {}  # pid -> 強制終了する時刻
+        self.reload_requested = False
+        self.stop_requested = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGHUP, signal.SIG_DFL)
+                run_worker(self.sock, self.threads, self.overrides)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers.add(pid)
+
+    def retire(self, pids):
+        deadline = time.monotonic() + config.SERVER_GRACEFUL_TIMEOUT
+        for pid in pids:
+            self.signal_worker(pid, signal.SIGTERM)
+            self.retiring[pid] = deadline
+
+    def signal_worker(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.retiring.pop(pid, None)
+            if pid in self.workers:
+                self.workers.discard(pid)
+                if not self.stop_requested:
+                    print(f"worker {pid} exited unexpectedly; restarting", file=sys.stderr)
+                    time.sleep(1)
+                    self.spawn()
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now >= deadline:
+                self.signal_worker(pid, signal.SIGKILL)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, 'reload_requested', True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, 'stop_requested', True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, 'stop_requested', True))
+
+        for _ in range(self.processes):
+            self.spawn()
+        while not self.stop_requested:
+            if self.reload_requested:
+                self.reload_requested = False
+                old = set(self.workers)
+                self.workers.clear()
+                for _ in range(self.processes):
+                    self.spawn()
+                self.retire(old)
+            self.reap()
+            self.kill_overdue()
+            time.sleep(0.2)
+
+        self.retire(self.workers)
+        self.workers.clear()
+        while self.retiring:
+            self.reap()
+            self.kill_overdue()
+            time.sleep(0.2)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WardBoard-OSS 常駐サーバー")
+    parser.add_argument('--host', default=config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=config.SERVER_PORT)
+    parser.add_argument('--processes', type=int, default=config.SERVER_PROCESSES)
+    parser.add_argument('--threads', type=int, default=config.SERVER_THREADS)
+    parser.add_argument('--database', help="データベースファイル（省略時は config.DATABASE）")
+    parser.add_argument('--access-log', action='store_true', help="アクセスログを標準エラーに出力する")
+    args = parser.parse_args(argv)
+
+    RequestHandler.access_log = args.access_log
+    # 再起動後も同じ秘密鍵を使い、ログイン状態を維持する
+    overrides = {'SECRET_KEY': config.SECRET_KEY}
+    if args.database:
+        overrides['DATABASE'] = args.database
+    processes = args.processes if hasattr(os, 'fork') else 1
+    # ボードのキャッシュはプロセス内でのみ無効化されるため、1プロセスの場合のみ使う
+    if config.BOARD_CACHE_ENABLED is None:
+        overrides['BOARD_CACHE_ENABLED'] = processes == 1
+    elif processes > 1 and config.BOARD_CACHE_ENABLED:
+        print("BOARD_CACHE_ENABLED is disabled because --processes > 1", file=sys.stderr)
+        overrides['BOARD_CACHE_ENABLED'] = False
+
+    sock = create_socket(args.host, args.port)
+    print(f"WardBoard-OSS listening on http://{args.host}:{args.port}/ "
+          f"({processes} process(es) x {args.threads} threads)", file=sys.stderr)
+    if processes == 1 and not hasattr(os, 'fork'):
+        run_worker(sock, args.threads, overrides)
+    else:
+        Master(sock, processes, args.threads, overrides).run()
+    sock.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,141 +1,945 @@
-from models import Room, Bed, RoomState, BedState, StateChangeLog, Status, User, Area, SystemJobState
-from peewee import JOIN, prefetch, fn, Case
+from models import db, Room, Bed, RoomState, BedState, StateChangeLog, ArchivedStateChangeLog, Status, User, Area, SystemJobState, OccupancyCounter, CacheVersion
+from peewee import JOIN, fn, Case, EXCLUDED, Value, Tuple
 import config
 import datetime
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, namedtuple
+
+class BoardCache:
+    """
+    エリアごとのボードデータを変更バージョン付きで保持するLRUキャッシュ
+    状態の書き込みやレイアウト変更でバージョンを上げると、次回の読み込みでDBから再取得される
+    """
+    def __init__(self, max_areas):
+        self.max_areas = max_areas
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # area_id -> (version, data)
+        self._versions = {}
+        self._epoch = 0  # 全エリア共通のバージョン
+        self._lock = threading.Lock()
+
+    def version(self, area_id):
+        with self._lock:
+            return (self._epoch, self._versions.get(area_id, 0))
+
+    def get(self, area_id):
+        with self._lock:
+            entry = self._entries.get(area_id)
+            if entry and entry[0] == (self._epoch, self._versions.get(area_id, 0)):
+                self._entries.move_to_end(area_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, area_id, version, data):
+        with self._lock:
+            self._entries[area_id] = (version, data)
+            self._entries.move_to_end(area_id)
+            while len(self._entries) > self.max_areas:
+                self._entries.popitem(last=False)
+
+    def bump(self, area_id=None):
+        # area_id 省略時は全エリアを無効化
+        with self._lock:
+            if area_id is None:
+                self._epoch += 1
+                self._entries.clear()
+            else:
+                self._versions[area_id] = self._versions.get(area_id, 0) + 1
+                self._entries.pop(area_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+board_cache = BoardCache(config.BOARD_CACHE_MAX_AREAS)
+
+_StatusSnapshot = namedtuple('_StatusSnapshot', ['version', 'by_id', 'by_key', 'active', 'occupied_ids', 'vacant_ids'])
+
+class StatusRegistry:
+    """
+    状態マスタ（Status）のプロセス内キャッシュ
+    同じプロセスでの変更は invalidate() で即時に、他のプロセスでの変更は
+    CacheVersion に記録したバージョンを check_interval 秒ごとに確認して反映する
+    """
+    VERSION_KEY = 'status'
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _current(self, force=False):
+        with self._lock:
+            snapshot = self._snapshot
+            now = time.monotonic()
+            if snapshot is not None and not force and now - self._checked_at < self.check_interval:
+                return snapshot
+            version = get_cache_version(self.VERSION_KEY)
+            if snapshot is None or force or snapshot.version != version:
+                snapshot = self._load(version)
+                self._snapshot = snapshot
+            self._checked_at = now
+            return snapshot
+
+    def _load(self, version):
+        statuses = list(Status.select().order_by(Status.sort_order, Status.id))
+        by_key = {s.key: s for s in statuses}
+        return _StatusSnapshot(
+            version=version,
+            by_id={s.id: s for s in statuses},
+            by_key=by_key,
+            active=[s for s in statuses if s.is_active],
+            occupied_ids=frozenset(by_key[k].id for k in config.OCCUPIED_STATUS_KEYS if k in by_key),
+            vacant_ids=frozenset(by_key[k].id for k in config.VACANT_STATUS_KEYS if k in by_key))
+
+    def get(self, status_id):
+        """
+        id から Status を返す（存在しない場合は None）
+        他のプロセスで追加された直後の状態にも対応するため、見つからない場合は1回だけ読み直す
+        """
+        try:
+            status_id = int(status_id)
+        except (TypeError, ValueError):
+            return None
+        status = self._current().by_id.get(status_id)
+        if status is None:
+            status = self._current(force=True).by_id.get(status_id)
+        return status
+
+    def get_by_key(self, key):
+        return self._current().by_key.get(key)
+
+    def version(self):
+        return self._current().version
+
+    def active(self):
+        """有効な状態の一覧（表示順）"""
+        return self._current().active
+
+    def occupied_ids(self):
+        """OCCUPIED_STATUS_KEYS に該当する状態のid"""
+        return self._current().occupied_ids
+
+    def vacant_ids(self):
+        """VACANT_STATUS_KEYS に該当する状態のid"""
+        return self._current().vacant_ids
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+status_registry = StatusRegistry(config.STATUS_REGISTRY_CHECK_INTERVAL)
+
+def get_cache_version(key):
+    return CacheVersion.select(CacheVersion.version).where(CacheVersion.key == key).scalar() or 0
+
+def bump_cache_version(key):
+    now = datetime.datetime.now()
+    (CacheVersion
+     .insert(key=key, version=1, created_at=now, updated_at=now)
+     .on_conflict(conflict_target=[CacheVersion.key],
+                  update={CacheVersion.version: CacheVersion.version + 1,
+                          CacheVersion.updated_at: EXCLUDED.updated_at})
+     .execute())
+
+def invalidate_statuses():
+    """
+    状態マスタの変更後に呼ぶ: 全プロセスの状態マスタのキャッシュとボードのキャッシュを無効化する
+    """
+    bump_cache_version(StatusRegistry.VERSION_KEY)
+    status_registry.invalidate()
+    invalidate_board_cache()
+
+def _require_status(status_id):
+    status = status_registry.get(status_id)
+    if status is None:
+        raise Status.DoesNotExist(f'Status {status_id} does not exist')
+    return status
+
+# 同一プロセス内のプッシュ接続（表示専用ボード）へ変更を通知するための条件変数
+_board_changed = threading.Condition()
+
+def invalidate_board_cache(area_id=None):
+    board_cache.bump(int(area_id) if area_id is not None else None)
+    notify_board_change()
+
+def notify_board_change():
+    with _board_changed:
+        _board_changed.notify_all()
+
+def wait_for_board_change(timeout):
+    """
+    同一プロセス内で状態が変更されるか timeout 秒経過するまで待機する
+    """
+    with _board_changed:
+        _board_changed.wait(timeout)
 
 def get_board_data(area_id):
-    # エリア内のアクティブな部屋を取得
-    rooms = Room.select().where(Room.area == area_id, Room.is_active == True).order_by(Room.sort_order)
-    
-    # アクティブなベッドと状態をプリフェッチ
-    # ※is_available=Falseのベッドもボード上には表示するため、is_activeのみで絞り込む
-    beds = Bed.select().where(Bed.is_active == True).order_by(Bed.sort_order)
-    # Statusも明示的に含めてプリフェッチ
-    bed_states = BedState.select()
-    room_states = RoomState.select()
-    
-    # prefetchを使用してRoom -> Bed -> BedState -> Status と Room -> RoomState -> Status を一括取得
-    rooms_with_data = prefetch(rooms, room_states, beds, bed_states, Status.select())
-    
-    rooms_data = []
-    for room in rooms_with_data:
-        # ベッドがある場合
-        bed_list = []
-        for bed in room.beds:
-            state = None
-            if hasattr(bed, 'state'):
-                # prefetchにより bed.state はリストになっている可能性がある
-                state = bed.state[0] if bed.state else None
-            
-            bed_list.append({
-                'obj': bed,
-                'state': state
-            })
-            
-        # 部屋の状態（ベッドがない場合のみ使用される想定）
-        room_state = None
-        if hasattr(room, 'state'):
-            room_state = room.state[0] if room.state else None
-            
-        rooms_data.append({
-            'room': room,
-            'beds': bed_list,
-            'room_state': room_state
-        })
+    if not config.BOARD_CACHE_ENABLED:
+        return _load_board_data(area_id)
+
+    area_id = int(area_id)
+    # 読み込み前のバージョンで保存するため、読み込み中に更新があれば次回は再取得される
+    version = board_cache.version(area_id)
+    rooms_data = board_cache.get(area_id)
+    if rooms_data is None:
+        rooms_data = _load_board_data(area_id)
+        board_cache.put(area_id, version, rooms_data)
     return rooms_data
 
+class CellView(namedtuple('CellView', ['status_id', 'updated_at'])):
+    """
+    1マス分の状態（ボードデータ用）
+    Status は id のみ保持し、表示時に status_registry から引く（未設定の場合は status_id が None）
+    """
+    __slots__ = ()
+
+    @property
+    def status(self):
+        return status_registry.get(self.status_id) if self.status_id is not None else None
+
+    @property
+    def key(self):
+        status = self.status
+        return status.key if status else None
+
+    @property
+    def label(self):
+        status = self.status
+        return status.label if status else '未設定'
+
+    @property
+    def color_class(self):
+        status = self.status
+        return status.color_class if status else None
+
+    @property
+    def icon_class(self):
+        status = self.status
+        return status.icon_class if status else 'bi-question-circle'
+
+UNSET_CELL = CellView(None, None)
+
+BedView = namedtuple('BedView', ['id', 'name', 'cell'])
+RoomCounts = namedtuple('RoomCounts', ['beds', 'occupied', 'vacant'])
+# 部屋カード1枚分の表示用データ
+# - cell: 部屋の状態（ベッドがない部屋で使用）、beds: BedView のタプル
+# - last_update: 状態の最終更新日時（ベッドがある部屋はベッドの中で最新のもの）
+# - is_empty: 空室（全ベッドが VACANT_STATUS_KEYS か未設定、ベッドがない部屋は部屋の状態が VACANT_STATUS_KEYS）
+# - counts: ベッド数・利用中・空き（未設定を含む）の数。ベッドがない部屋は部屋の状態で 0 / 1
+# - stamp: 部屋カードの部分キャッシュのキー
+RoomView = namedtuple('RoomView', ['id', 'code', 'name', 'cell', 'beds', 'last_update', 'is_empty', 'counts', 'stamp'])
+
+def _load_board_data(area_id):
+    """
+    エリアのボードデータ（RoomView のリスト）を作成する
+    部屋・ベッド・状態を1回のJOINクエリで値のみ取得し、モデルのインスタンスは作らない
+    """
+    # ※is_available=Falseのベッドもボード上には表示するため、is_activeのみで絞り込む
+    query = (Room
+             .select(Room.id, Room.code, Room.name, Room.created_at, Room.updated_at,
+                     RoomState.status, RoomState.created_at, RoomState.updated_at,
+                     Bed.id, Bed.name, Bed.created_at, Bed.updated_at,
+                     BedState.status, BedState.created_at, BedState.updated_at)
+             .join(RoomState, JOIN.LEFT_OUTER, on=(RoomState.room == Room.id))
+             .switch(Room)
+             .join(Bed, JOIN.LEFT_OUTER, on=((Bed.room == Room.id) & (Bed.is_active == True)))
+             .join(BedState, JOIN.LEFT_OUTER, on=(BedState.bed == Bed.id))
+             .where(Room.area == area_id, Room.is_active == True)
+             .order_by(Room.sort_order, Room.id, Bed.sort_order, Bed.id)
+             .tuples())
+
+    # 1行 = 部屋 x ベッド（ベッドがない部屋は1行）なので、部屋IDの切り替わりでまとめる
+    rooms = []
+    current = None
+    for (room_id, code, name, room_created, room_updated, room_status_id, room_state_created, room_state_updated,
+         bed_id, bed_name, bed_created, bed_updated, bed_status_id, bed_state_created, bed_state_updated) in query:
+        if current is None or current['id'] != room_id:
+            current = {
+                'id': room_id,
+                'code': code,
+                'name': name,
+                'cell': CellView(room_status_id, room_state_updated) if room_status_id is not None else UNSET_CELL,
+                'beds': [],
+                'stamps': [room_updated or room_created, room_state_updated or room_state_created],
+            }
+            rooms.append(current)
+
+        if bed_id is not None:
+            cell = CellView(bed_status_id, bed_state_updated) if bed_status_id is not None else UNSET_CELL
+            current['beds'].append(BedView(bed_id, bed_name, cell))
+            current['stamps'] += [bed_updated or bed_created, bed_state_updated or bed_state_created]
+
+    status_version = status_registry.version()
+    occupied_ids = status_registry.occupied_ids()
+    vacant_ids = status_registry.vacant_ids()
+    return [_room_view(room, occupied_ids, vacant_ids, status_version) for room in rooms]
+
+def _room_view(room, occupied_ids, vacant_ids, status_version):
+    # 表示用の値はここで計算し、テンプレートでは出力するだけにする
+    beds = tuple(room['beds'])
+    if beds:
+        cells = [bed.cell for bed in beds]
+        occupied = sum(1 for cell in cells if cell.status_id in occupied_ids)
+        vacant = sum(1 for cell in cells if cell.status_id is None or cell.status_id in vacant_ids)
+        last_update = max((cell.updated_at for cell in cells if cell.updated_at), default=None)
+        is_empty = vacant == len(beds)
+    else:
+        cell = room['cell']
+        occupied = int(cell.status_id in occupied_ids)
+        vacant = int(cell.status_id in vacant_ids)
+        last_update = cell.updated_at
+        is_empty = bool(vacant)
+
+    # 部屋・ベッド・状態の最新の更新日時と、ベッド数・状態マスタのバージョンが同じなら表示内容も同じ
+    newest = max(stamp for stamp in room['stamps'] if stamp is not None)
+    return RoomView(
+        id=room['id'],
+        code=room['code'],
+        name=room['name'],
+        cell=room['cell'],
+        beds=beds,
+        last_update=last_update,
+        is_empty=is_empty,
+        counts=RoomCounts(len(beds), occupied, vacant),
+        stamp=(room['id'], newest.isoformat(), len(beds), status_version))
+
+def _state_cell(target_type, target_id, state, room_id=None):
+    # 表示専用ボードで1マス分を書き換えるための情報
+    status = status_registry.get(state.status_id)
+    return {
+        'type': target_type,
+        'id': target_id,
+        'room_id': room_id,
+        'status_id': status.id,
+        'key': status.key,
+        'label': status.label,
+        'color_class': status.color_class,
+        'icon_class': status.icon_class,
+        'updated_at': state.updated_at.isoformat() if state.updated_at else None
+    }
+
+def get_state_cells(area_id, room_ids=None, bed_ids=None):
+    """
+    エリア内の部屋・ベッドの現在状態をマス単位で返す
+    room_ids / bed_ids を指定した場合はそれらのみを返す
+    """
+    cells = []
+    if room_ids is None or room_ids:
+        # 部屋の状態が表示されるのはベッドがない部屋のみ（ベッドを追加する前の状態が残っている場合は返さない）
+        active_beds = Bed.select(Bed.id).where(Bed.room == Room.id, Bed.is_active == True)
+        room_states = (RoomState
+                       .select(RoomState)
+                       .join(Room)
+                       .where(Room.area == area_id, Room.is_active == True, ~fn.EXISTS(active_beds)))
+        if room_ids is not None:
+            room_states = room_states.where(Room.id << list(room_ids))
+        cells += [_state_cell('room', state.room_id, state) for state in room_states]
+
+    if bed_ids is None or bed_ids:
+        bed_states = (BedState
+                      .select(BedState, Bed.id, Bed.room)
+                      .join(Bed)
+                      .join(Room)
+                      .where(Room.area == area_id, Room.is_active == True, Bed.is_active == True))
+        if bed_ids is not None:
+            bed_states = bed_states.where(Bed.id << list(bed_ids))
+        cells += [_state_cell('bed', state.bed.id, state, room_id=state.bed.room_id) for state in bed_states]
+    return cells
+
+def get_board_changes(area_id, since=None):
+    """
+    StateChangeLog の id をカーソルとして、since より後に状態が変わった部屋・ベッドを返す
+    since 省略時・カーソルが不正な場合・自動リセットなどエリアを特定できない変更があった場合は全件を返す (full=True)
+    """
+    cursor = StateChangeLog.select(fn.MAX(StateChangeLog.id)).scalar() or 0
+    full = since is None or since > cursor
+
+    room_ids, bed_ids = set(), set()
+    if not full and since < cursor:
+        logs = (StateChangeLog
+                .select(StateChangeLog.target_type, StateChangeLog.room, StateChangeLog.bed, StateChangeLog.area)
+                .where(StateChangeLog.id > since, StateChangeLog.id <= cursor)
+                .where((StateChangeLog.area == area_id) | StateChangeLog.area.is_null())
+                .tuples())
+        for target_type, room_id, bed_id, log_area_id in logs:
+            if log_area_id is None:
+                full = True
+                break
+            if target_type == 'room':
+                room_ids.add(room_id)
+            elif target_type == 'bed':
+                bed_ids.add(bed_id)
+
+    if full:
+        cells = get_state_cells(area_id)
+    else:
+        cells = get_state_cells(area_id, room_ids=room_ids, bed_ids=bed_ids)
+    return {
+        'area_id': area_id,
+        'cursor': cursor,
+        'full': full,
+        'rooms': [c for c in cells if c['type'] == 'room'],
+        'beds': [c for c in cells if c['type'] == 'bed']
+    }
+
+def _board_stamps(area_id, include_states=True):
+    rooms = Room.select(Room.id).where(Room.area == area_id)
+    beds = Bed.select(Bed.id).where(Bed.room << rooms)
+
+    def stamp(model, *where):
+        query = model.select(Value(model._meta.table_name),
+                             fn.MAX(fn.COALESCE(model.updated_at, model.created_at)),
+                             fn.COUNT(model.id))
+        return query.where(*where) if where else query
+
+    # Area / Status はナビゲーションや状態マスタとして全件が表示に影響する
+    query = (stamp(Area)
+             + stamp(Status)
+             + stamp(Room, Room.area == area_id)
+             + stamp(Bed, Bed.room << rooms))
+    if include_states:
+        query = (query
+                 + stamp(RoomState, RoomState.room << rooms)
+                 + stamp(BedState, BedState.bed << beds))
+    return sorted(query.tuples())
+
+def _signature(rows):
+    return '|'.join(f'{table}:{value}:{count}' for table, value, count in rows)
+
+def get_board_validator(area_id):
+    """
+    ボード表示の変更検出用に、エリアに関係する各テーブルの最終更新日時と件数を1回のクエリで取得する
+    戻り値: (署名文字列, 最終更新日時)
+    """
+    rows = _board_stamps(area_id)
+    last_modified = None
+    for _, stamp_value, _ in rows:
+        if stamp_value:
+            value = datetime.datetime.fromisoformat(str(stamp_value))
+            if last_modified is None or value > last_modified:
+                last_modified = value
+    return _signature(rows), last_modified
+
+def get_board_layout_version(area_id):
+    """
+    ボードの構成（エリア・状態マスタ・部屋・ベッドの追加・名称変更・無効化など）の署名を返す
+    状態の変更では変わらないため、プッシュ更新の表示端末が再読み込みの要否を判定するのに使う
+    """
+    return _signature(_board_stamps(area_id, include_states=False))
+
 def update_room_state(room_id, status_id, user):
-    room = Room.get_by_id(room_id)
-    status = Status.get_by_id(status_id)
-    
-    state, created = RoomState.get_or_create(room=room, defaults={'status': status})
-    old_status = None if created else state.status
-    
-    state.status = status
-    state.updated_by = user
-    state.updated_at = datetime.datetime.now() # 明示的に更新
-    state.save()
-    
-    # 履歴保存
-    StateChangeLog.create(
-        target_type='room',
-        room=room,
-        area=room.area,
-        from_status=old_status,
-        to_status=status,
-        changed_by=user
-    )
+    """
+    部屋の状態を変更する
+    1つのトランザクションで、対象の取得・状態の保存（UPSERT）・履歴の保存の3文のみを実行する
+    """
+    status = _require_status(status_id)
+    now = datetime.datetime.now()
+    with db.atomic('IMMEDIATE'):
+        row = (Room
+               .select(Room.area, RoomState.status)
+               .join(RoomState, JOIN.LEFT_OUTER, on=(RoomState.room == Room.id))
+               .where(Room.id == room_id)
+               .tuples()
+               .first())
+        if row is None:
+            raise Room.DoesNotExist(f'Room {room_id} does not exist')
+        area_id, old_status_id = row
+
+        _upsert_state(RoomState, RoomState.room, room_id, status.id, user, now)
+        # 履歴保存
+        write_change_logs([_change_log_row('room', area_id, old_status_id, status.id,
+                                           user.id if user else None, now, room_id=room_id)])
+
+    invalidate_board_cache(area_id)
 
 def update_bed_state(bed_id, status_id, user):
-    bed = Bed.get_by_id(bed_id)
-    status = Status.get_by_id(status_id)
-    
-    state, created = BedState.get_or_create(bed=bed, defaults={'status': status})
-    old_status = None if created else state.status
-    
-    state.status = status
-    state.updated_by = user
-    state.updated_at = datetime.datetime.now() # 明示的に更新
-    state.save()
-    
-    # 履歴保存
-    StateChangeLog.create(
-        target_type='bed',
-        bed=bed,
-        area=bed.room.area,
-        from_status=old_status,
-        to_status=status,
-        changed_by=user
-    )
+    """
+    ベッドの状態を変更する
+    対象の取得（部屋・エリアは結合で解決）・状態の保存（UPSERT）・履歴の保存の3文に、
+    状態が変わった場合のみ集計カウンタの更新1文を加えて、1つのトランザクションで実行する
+    """
+    status = _require_status(status_id)
+    now = datetime.datetime.now()
+    with db.atomic('IMMEDIATE'):
+        row = (Bed
+               .select(Room.area, Bed.is_active, Bed.is_available, BedState.status)
+               .join(Room)
+               .switch(Bed)
+               .join(BedState, JOIN.LEFT_OUTER, on=(BedState.bed == Bed.id))
+               .where(Bed.id == bed_id)
+               .tuples()
+               .first())
+        if row is None:
+            raise Bed.DoesNotExist(f'Bed {bed_id} does not exist')
+        area_id, is_active, is_available, old_status_id = row
+
+        _upsert_state(BedState, BedState.bed, bed_id, status.id, user, now)
+
+        # 集計カウンタの更新（非アクティブなベッドは集計対象外）
+        if is_active and (old_status_id or 0) != status.id:
+            _apply_counter_deltas([
+                (area_id, old_status_id or 0, is_available, -1),
+                (area_id, status.id, is_available, 1),
+            ])
+
+        # 履歴保存
+        write_change_logs([_change_log_row('bed', area_id, old_status_id, status.id,
+                                           user.id if user else None, now, bed_id=bed_id)])
+
+    invalidate_board_cache(area_id)
+
+def _upsert_state(model, target_field, target_id, status_id, user, now):
+    (model
+     .insert({target_field: target_id, model.status: status_id, model.updated_by: user.id if user else None,
+              model.created_at: now, model.updated_at: now})
+     .on_conflict(conflict_target=[target_field],
+                  update={model.status: EXCLUDED.status_id,
+                          model.updated_by: EXCLUDED.updated_by_id,
+                          model.updated_at: EXCLUDED.updated_at})
+     .execute())
+
+def bulk_update_states(status_id, user, room_ids=(), bed_ids=()):
+    """
+    複数の部屋・ベッドを1つのトランザクションで同じ状態に変更する
+    状態は一括UPDATE（未設定のものは一括INSERT）、履歴は insert_many でまとめて保存する
+    戻り値: 変更した部屋・ベッドの数
+    """
+    status = _require_status(status_id)
+    room_ids = sorted({int(i) for i in room_ids})
+    bed_ids = sorted({int(i) for i in bed_ids})
+    now = datetime.datetime.now()
+    user_id = user.id if user else None
+    logs = []
+    area_ids = set()
+
+    with db.atomic('IMMEDIATE'):
+        if room_ids:
+            rooms = list(Room
+                         .select(Room.id, Room.area, RoomState.status)
+                         .join(RoomState, JOIN.LEFT_OUTER, on=(RoomState.room == Room.id))
+                         .where(Room.id.in_(room_ids))
+                         .tuples())
+            _bulk_save_states(RoomState, RoomState.room, [room_id for room_id, _, _ in rooms],
+                              {room_id for room_id, _, old in rooms if old is not None}, status.id, user_id, now)
+            for room_id, area_id, old_status_id in rooms:
+                logs.append(_change_log_row('room', area_id, old_status_id, status.id, user_id, now, room_id=room_id))
+                area_ids.add(area_id)
+
+        if bed_ids:
+            beds = list(Bed
+                        .select(Bed.id, Room.area, Bed.is_active, Bed.is_available, BedState.status)
+                        .join(Room)
+                        .switch(Bed)
+                        .join(BedState, JOIN.LEFT_OUTER, on=(BedState.bed == Bed.id))
+                        .where(Bed.id.in_(bed_ids))
+                        .tuples())
+            _bulk_save_states(BedState, BedState.bed, [bed_id for bed_id, _, _, _, _ in beds],
+                              {bed_id for bed_id, _, _, _, old in beds if old is not None}, status.id, user_id, now)
+            # 集計カウンタの増減は (エリア, 状態, 運用可否) ごとにまとめて加算する
+            deltas = {}
+            for bed_id, area_id, is_active, is_available, old_status_id in beds:
+                if is_active and (old_status_id or 0) != status.id:
+                    for key, delta in (((area_id, old_status_id or 0, is_available), -1),
+                                       ((area_id, status.id, is_available), 1)):
+                        deltas[key] = deltas.get(key, 0) + delta
+                logs.append(_change_log_row('bed', area_id, old_status_id, status.id, user_id, now, bed_id=bed_id))
+                area_ids.add(area_id)
+            _apply_counter_deltas([key + (delta,) for key, delta in deltas.items()])
+
+        write_change_logs(logs)
+
+    for area_id in area_ids:
+        invalidate_board_cache(area_id)
+    return len(logs)
+
+def _bulk_save_states(model, target_field, target_ids, existing_ids, status_id, user_id, now):
+    # 状態の行があるものは一括UPDATE、ないものは一括INSERT
+    if existing_ids:
+        (model
+         .update(status=status_id, updated_by=user_id, updated_at=now)
+         .where(target_field.in_(sorted(existing_ids)))
+         .execute())
+    new_ids = [i for i in target_ids if i not in existing_ids]
+    for start in range(0, len(new_ids), 100):
+        model.insert_many([{target_field.name: i, 'status': status_id, 'updated_by': user_id,
+                            'updated_at': now, 'created_at': now}
+                           for i in new_ids[start:start + 100]]).execute()
+
+# --- 変更履歴の書き込み ---
+
+_log_writer = None
+
+def _change_log_row(target_type, area_id, from_status_id, to_status_id, user_id, changed_at, room_id=None, bed_id=None):
+    return {
+        'target_type': target_type,
+        'room': room_id,
+        'bed': bed_id,
+        'area': area_id,
+        'from_status': from_status_id,
+        'to_status': to_status_id,
+        'changed_by': user_id,
+        'changed_at': changed_at,
+        'note': None,
+        'meta': None,
+    }
+
+def write_change_logs(rows):
+    """
+    状態変更の履歴（_change_log_row の辞書のリスト）を保存する
+    非同期書き込み（LOG_WRITE_BEHIND）の開始後はキューに追加するだけで、DBへはまとめて書き込まれる
+    """
+    if _log_writer is not None:
+        for row in rows:
+            _log_writer.put(row)
+        return
+    for start in range(0, len(rows), 100):
+        StateChangeLog.insert_many(rows[start:start + 100]).execute()
+
+def start_log_writer():
+    """
+    常駐プロセス用: 変更履歴の非同期書き込みを開始する（前回異常終了時のスプールも書き込む）
+    """
+    global _log_writer
+    if _log_writer is None:
+        import atexit
+        import log_writer
+        _log_writer = log_writer.LogWriter(config.LOG_SPOOL_DIR, batch_size=config.LOG_WRITE_BATCH_SIZE,
+                                           interval=config.LOG_WRITE_INTERVAL, fsync=config.LOG_SPOOL_FSYNC,
+                                           on_flush=notify_board_change)
+        _log_writer.start()
+        atexit.register(stop_log_writer)
+    return _log_writer
+
+def stop_log_writer():
+    """
+    変更履歴の非同期書き込みを停止し、未書き込みの履歴を書き込む
+    """
+    global _log_writer
+    if _log_writer is not None:
+        _log_writer.stop()
+        _log_writer = None
 
 def get_bed_counts(area_id=None):
     """
     エリアごとのベッド集計を取得する
+    集計カウンタ (OccupancyCounter) を読むため、ベッド数ではなくエリア数に比例したコストになる
     """
-    # 対象エリアの取得
-    if area_id:
-        areas = Area.select().where(Area.id == area_id, Area.is_active == True)
-    else:
-        areas = Area.select().where(Area.is_active == True).order_by(Area.sort_order)
-    
-    # 全ての有効なステータスを取得（辞書化）
-    occupied_status_ids = [s.id for s in Status.select().where(Status.key << config.OCCUPIED_STATUS_KEYS)]
-    
     # VACANT_STATUS_KEYS に含まれるもの、または status が設定されていないものを「空き」とみなす
-    # ただし、現状のロジックでは BedState が必ず存在することを想定しているか、
-    # BedState がない場合は「未設定」として扱われ、occupied にはカウントされない
-    
+    # BedState がない場合は「未設定」(status_id=0) として扱われ、occupied にはカウントされない
+    # アクティブな全ベッドのうち is_available=True のものがカウント対象
+    available = (OccupancyCounter.is_available == True)
+    occupied = available & (OccupancyCounter.status_id << list(status_registry.occupied_ids()))
+
+    query = (Area
+             .select(Area,
+                     fn.COALESCE(fn.SUM(Case(None, [(available, OccupancyCounter.bed_count)], 0)), 0).alias('total_available_beds'),
+                     fn.COALESCE(fn.SUM(Case(None, [(OccupancyCounter.is_available == False, OccupancyCounter.bed_count)], 0)), 0).alias('unavailable_beds'),
+                     fn.COALESCE(fn.SUM(Case(None, [(occupied, OccupancyCounter.bed_count)], 0)), 0).alias('occupied_beds'))
+             .join(OccupancyCounter, JOIN.LEFT_OUTER, on=(OccupancyCounter.area == Area.id))
+             .where(Area.is_active == True)
+             .group_by(Area.id)
+             .order_by(Area.sort_order, Area.id))
+    if area_id:
+        query = query.where(Area.id == area_id)
+
+    now = datetime.datetime.now() # 簡易的に現在時刻
     results = []
-    for area in areas:
-        # このエリアのアクティブな全ベッドを取得 (is_active=True)
-        # かつ is_available=True のものがカウント対象
-        beds_query = Bed.select().join(Room).where(Room.area == area, Bed.is_active == True)
-        
-        total_available = beds_query.where(Bed.is_available == True).count()
-        unavailable = beds_query.where(Bed.is_available == False).count()
-        
-        # BedState と JOIN して現在のステータスを判定
-        occupied_count = (BedState.select()
-                          .join(Bed).join(Room)
-                          .where(Room.area == area, 
-                                 Bed.is_active == True, 
-                                 Bed.is_available == True,
-                                 BedState.status << occupied_status_ids)
-                          .count())
-        
+    for area in query:
         # 空き数は「総運用病床数 - 利用中数」で計算（仕様の通り）
         results.append({
             'area': area,
-            'total_available_beds': total_available,
-            'unavailable_beds': unavailable,
-            'occupied_beds': occupied_count,
-            'vacant_beds': total_available - occupied_count,
-            'updated_at': datetime.datetime.now() # 簡易的に現在時刻
+            'total_available_beds': area.total_available_beds,
+            'unavailable_beds': area.unavailable_beds,
+            'occupied_beds': area.occupied_beds,
+            'vacant_beds': area.total_available_beds - area.occupied_beds,
+            'updated_at': now
         })
-        
+
     return results
 
+def get_bed_totals(bed_counts):
+    """
+    get_bed_counts の結果から全エリア合計の行を作成する（追加のクエリは発行しない）
+    """
+    totals = {
+        'area': None,
+        'total_available_beds': 0,
+        'unavailable_beds': 0,
+        'occupied_beds': 0,
+        'vacant_beds': 0,
+        'updated_at': datetime.datetime.now()
+    }
+    for item in bed_counts:
+        for key in ('total_available_beds', 'unavailable_beds', 'occupied_beds', 'vacant_beds'):
+            totals[key] += item[key]
+    return totals
+
+# --- 変更履歴 ---
+
+def get_change_logs(area_id=None, target_type=None, user_id=None, before=None, limit=None):
+    """
+    変更履歴を新しい順に1ページ分取得する（関連する行もJOINで取得するため、表示時に追加のクエリは発生しない）
+    before: 前ページ最後の (changed_at, id)。この位置より古い履歴を返す（キーセット方式）
+    アーカイブ有効時は、本体のDBで1ページに満たない場合のみアーカイブの続きを読む
+    戻り値: (履歴のリスト, 次ページの before。最後のページなら None)
+    """
+    limit = limit or config.LOG_PAGE_SIZE
+    logs = list(_change_log_query(StateChangeLog, area_id, target_type, user_id, before, limit + 1))
+    if len(logs) <= limit and config.LOG_ARCHIVE_ENABLED:
+        # アーカイブ内の履歴はすべて本体の履歴より古いため、続けて読めば順序は保たれる
+        cursor = (logs[-1].changed_at, logs[-1].id) if logs else before
+        logs += list(_change_log_query(ArchivedStateChangeLog, area_id, target_type, user_id,
+                                       cursor, limit + 1 - len(logs)))
+
+    next_before = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_before = (logs[-1].changed_at, logs[-1].id)
+    return logs, next_before
+
+def _change_log_query(model, area_id, target_type, user_id, before, limit):
+    # model は StateChangeLog または ArchivedStateChangeLog（同じ列名を持つ）
+    BedRoom = Room.alias()
+    FromStatus = Status.alias()
+    ToStatus = Status.alias()
+    query = (model
+             .select(model, Area, Room, Bed, BedRoom, FromStatus, ToStatus, User)
+             .join(Area, JOIN.LEFT_OUTER, on=(model.area == Area.id), attr='area')
+             .switch(model)
+             .join(Room, JOIN.LEFT_OUTER, on=(model.room == Room.id), attr='room')
+             .switch(model)
+             .join(Bed, JOIN.LEFT_OUTER, on=(model.bed == Bed.id), attr='bed')
+             .join(BedRoom, JOIN.LEFT_OUTER, on=(Bed.room == BedRoom.id), attr='room')
+             .switch(model)
+             .join(FromStatus, JOIN.LEFT_OUTER, on=(model.from_status == FromStatus.id), attr='from_status')
+             .switch(model)
+             .join(ToStatus, JOIN.LEFT_OUTER, on=(model.to_status == ToStatus.id), attr='to_status')
+             .switch(model)
+             .join(User, JOIN.LEFT_OUTER, on=(model.changed_by == User.id), attr='changed_by')
+             .order_by(model.changed_at.desc(), model.id.desc())
+             .limit(limit))
+
+    if area_id:
+        query = query.where(model.area == area_id)
+    if target_type:
+        query = query.where(model.target_type == target_type)
+    if user_id:
+        query = query.where(model.changed_by == user_id)
+    if before:
+        # (changed_at, id) の行値比較はインデックスの範囲検索で処理される
+        query = query.where(Tuple(model.changed_at, model.id) < Tuple(*before))
+    return query
+
+def purge_logs(days=None, now=None):
+    """
+    保持期間（LOG_RETENTION_DAYS）より古い変更履歴を削除する（アーカイブ有効時はアーカイブからも削除）
+    1回の書き込みロックを短くするため LOG_PURGE_BATCH_SIZE 件ずつ削除し、間に他の書き込みを通す
+    戻り値: {'rows': 削除件数, 'pages': ファイルから解放したページ数}
+    """
+    days = config.LOG_RETENTION_DAYS if days is None else days
+    if days <= 0:
+        return {'rows': 0, 'pages': 0}
+    threshold = (now or datetime.datetime.now()) - datetime.timedelta(days=days)
+
+    models = [StateChangeLog, ArchivedStateChangeLog] if config.LOG_ARCHIVE_ENABLED else [StateChangeLog]
+    rows = 0
+    for model in models:
+        rows += _remove_logs_in_batches(model, threshold)
+    return {'rows': rows, 'pages': reclaim_free_pages()}
+
+def archive_logs(days=None, now=None):
+    """
+    LOG_HOT_DAYS より古い変更履歴をアーカイブDBへ移動する（LOG_ARCHIVE_ENABLED 時のみ）
+    戻り値: {'rows': 移動件数, 'pages': 本体のDBファイルから解放したページ数}
+    """
+    if not config.LOG_ARCHIVE_ENABLED:
+        return {'rows': 0, 'pages': 0}
+    days = config.LOG_HOT_DAYS if days is None else days
+    threshold = (now or datetime.datetime.now()) - datetime.timedelta(days=days)
+    rows = _remove_logs_in_batches(StateChangeLog, threshold, archive=True)
+    return {'rows': rows, 'pages': reclaim_free_pages()}
+
+def _remove_logs_in_batches(model, threshold, archive=False):
+    """
+    threshold より古い履歴を LOG_PURGE_BATCH_SIZE 件ずつ削除する（archive=True の場合はアーカイブへ複製してから削除）
+    戻り値: 処理件数
+    """
+    # 本体の最新の1件は削除・アーカイブのどちらでも残し、id が再利用されないようにする
+    # （差分取得のカーソルが戻ったり、アーカイブ済みの id と重複して複製されずに消えたりしないように）
+    newest_id = model.select(fn.MAX(model.id)).scalar() if model is StateChangeLog else None
+    rows = 0
+    while True:
+        with db.atomic('IMMEDIATE'):
+            batch = (model
+                     .select(model.id)
+                     .where(model.changed_at < threshold)
+                     .order_by(model.changed_at)
+                     .limit(config.LOG_PURGE_BATCH_SIZE))
+            if newest_id is not None:
+                batch = batch.where(model.id != newest_id)
+            if archive:
+                # WAL モードでは2つのDBへの書き込みは個別にコミットされるため、途中で中断された場合に
+                # 再実行で重複しないよう、アーカイブ済みの id は無視する
+                fields = [StateChangeLog._meta.fields[name] for name in ArchivedStateChangeLog._meta.sorted_field_names]
+                (ArchivedStateChangeLog
+                 .insert_from(StateChangeLog.select(*fields).where(StateChangeLog.id.in_(batch)),
+                              ArchivedStateChangeLog._meta.sorted_fields)
+                 .on_conflict_ignore()
+                 .execute())
+            deleted = model.delete().where(model.id.in_(batch)).execute()
+        rows += deleted
+        if deleted < config.LOG_PURGE_BATCH_SIZE:
+            break
+        time.sleep(config.LOG_PURGE_PAUSE)
+    return rows
+
+def reclaim_free_pages():
+    """
+    削除で空いたページをファイルから解放する（auto_vacuum=incremental のDBのみ。それ以外は再利用を待つ）
+    戻り値: 解放したページ数
+    """
+    if db.pragma('auto_vacuum') != 2:
+        return 0
+    freed = 0
+    while True:
+        free_pages = db.pragma('freelist_count')
+        if free_pages == 0:
+            break
+        # 一度に解放するページ数を抑え、間に他の書き込みを通す
+        db.execute_sql('PRAGMA incremental_vacuum(%d)' % config.LOG_PURGE_BATCH_SIZE).fetchall()
+        released = free_pages - db.pragma('freelist_count')
+        if released <= 0:
+            break
+        freed += released
+        time.sleep(config.LOG_PURGE_PAUSE)
+    return freed
+
+_log_purge_thread = None
+
+def start_log_purge_scheduler():
+    """
+    常駐プロセス用: LOG_PURGE_INTERVAL 秒ごとに古い変更履歴をアーカイブ・削除するスレッドを開始する
+    """
+    global _log_purge_thread
+    if _log_purge_thread is not None:
+        return _log_purge_thread
+
+    def loop():
+        while True:
+            try:
+                with db.connection_context():
+                    archived = archive_logs()
+                    result = purge_logs()
+                if archived['rows']:
+                    print(f"log archive: {archived['rows']} rows moved, {archived['pages']} pages freed", file=sys.stderr)
+                if result['rows']:
+                    print(f"log purge: {result['rows']} rows deleted, {result['pages']} pages freed", file=sys.stderr)
+            except Exception:
+                # 失敗しても次回に再試行する
+                traceback.print_exc()
+            time.sleep(config.LOG_PURGE_INTERVAL)
+
+    _log_purge_thread = threading.Thread(target=loop, name='log-purge', daemon=True)
+    _log_purge_thread.start()
+    return _log_purge_thread
+
+# --- 集計カウンタ ---
+def _apply_counter_deltas(deltas):
+    """
+    (area_id, status_id, is_available, delta) のリストを集計カウンタに加算する
+    """
+    now = datetime.datetime.now()
+    rows = [{'area': area_id, 'status_id': status_id or 0, 'is_available': bool(is_available),
+             'bed_count': delta, 'created_at': now, 'updated_at': now}
+            for area_id, status_id, is_available, delta in deltas if delta]
+    if not rows:
+        return
+    (OccupancyCounter
+     .insert_many(rows)
+     .on_conflict(conflict_target=[OccupancyCounter.area, OccupancyCounter.status_id, OccupancyCounter.is_available],
+                  update={OccupancyCounter.bed_count: OccupancyCounter.bed_count + EXCLUDED.bed_count,
+                          OccupancyCounter.updated_at: EXCLUDED.updated_at})
+     .execute())
+
+def _count_beds_by_status(area_ids=None):
+    """
+    ベッドの実データから (area_id, status_id, is_available) ごとの件数を集計する
+    """
+    status_id = fn.COALESCE(BedState.status, 0)
+    query = (Bed
+             .select(Room.area, status_id.alias('status_id'), Bed.is_available, fn.COUNT(Bed.id).alias('bed_count'))
+             .join(Room)
+             .switch(Bed)
+             .join(BedState, JOIN.LEFT_OUTER, on=(BedState.bed == Bed.id))
+             .where(Bed.is_active == True)
+             .group_by(Room.area, status_id, Bed.is_available)
+             .tuples())
+    if area_ids is not None:
+        query = query.where(Room.area << list(area_ids))
+    return {(area, status, bool(available)): count for area, status, available, count in query}
+
+def rebuild_counters(area_ids=None):
+    """
+    集計カウンタを実データから再構築する（area_ids 省略時は全エリア）
+    """
+    now = datetime.datetime.now()
+    # 集計から書き換えまでの間に他の状態変更が割り込まないよう、書き込みロックを取ってから集計する
+    with db.atomic('IMMEDIATE'):
+        counts = _count_beds_by_status(area_ids)
+        delete = OccupancyCounter.delete()
+        if area_ids is not None:
+            delete = delete.where(OccupancyCounter.area << list(area_ids))
+        delete.execute()
+
+        rows = [{'area': area, 'status_id': status, 'is_available': available,
+                 'bed_count': count, 'created_at': now, 'updated_at': now}
+                for (area, status, available), count in counts.items()]
+        for i in range(0, len(rows), 100):
+            OccupancyCounter.insert_many(rows[i:i + 100]).execute()
+
+def check_counters():
+    """
+    集計カウンタと実データを比較し、ずれている組み合わせを返す（空リストなら整合）
+    """
+    # 実データとカウンタを同じ時点（1つの読み込みトランザクション）で比較する
+    with db.atomic():
+        expected = _count_beds_by_status()
+        actual = {(c.area_id, c.status_id, c.is_available): c.bed_count
+                  for c in OccupancyCounter.select() if c.bed_count}
+
+    drift = []
+    for key in sorted(set(expected) | set(actual)):
+        if expected.get(key, 0) != actual.get(key, 0):
+            area_id, status_id, is_available = key
+            drift.append({
+                'area_id': area_id,
+                'status_id': status_id,
+                'is_available': is_available,
+                'expected': expected.get(key, 0),
+                'actual': actual.get(key, 0)
+            })
+    return drift
+
+# 自動リセットを実行済み（または他プロセスが実行済み）と確認できた日付
+# 同じ日の2回目以降の判定ではDBにアクセスしない
+_auto_reset_done_date = None
+
 def maybe_run_auto_reset(now=None):
+    global _auto_reset_done_date
     if not config.AUTO_RESET_ENABLED:
         return
 
@@ -149,76 +953,142 @@ def maybe_run_auto_reset(now=None):
     # 現在時刻がリセット予定時刻を過ぎているか確認
     if now < reset_time_today:
         return
-        
-    # DBから最終実行状況を確認
-    job_state, created = SystemJobState.get_or_create(job_key='auto_reset')
-    
-    # 今日すでに実行済みならスキップ
-    if job_state.last_run_date == now.date():
+
+    # このプロセスで今日すでに確認済みならスキップ
+    if _auto_reset_done_date == now.date():
         return
-        
-    # 実行
-    run_auto_reset(now)
-    
-    # 実行済み記録
-    job_state.last_run_at = now
-    job_state.last_run_date = now.date()
-    job_state.save()
+
+    # 他のプロセスで実行済みなら書き込みロックを取らずに終了する（CGI では毎回ここを通るため）
+    last_run_date = (SystemJobState
+                     .select(SystemJobState.last_run_date)
+                     .where(SystemJobState.job_key == 'auto_reset')
+                     .scalar())
+    if last_run_date == now.date():
+        _auto_reset_done_date = now.date()
+        return
+
+    SystemJobState.get_or_create(job_key='auto_reset')
+    with db.atomic('IMMEDIATE'):
+        # 最終実行日を条件付きで更新できたプロセスだけが実行する（複数プロセス・スレッドでの二重実行防止）
+        # リセットに失敗した場合は実行済み記録もロールバックされる
+        claimed = (SystemJobState
+                   .update(last_run_at=now, last_run_date=now.date(), updated_at=now)
+                   .where(SystemJobState.job_key == 'auto_reset',
+                          SystemJobState.last_run_date.is_null() | (SystemJobState.last_run_date != now.date()))
+                   .execute())
+        updated = run_auto_reset(now) if claimed else 0
+
+    # コミット前に無効化すると、他のスレッドが更新前のデータを新しいバージョンでキャッシュし得る
+    if updated:
+        invalidate_board_cache()
+
+    _auto_reset_done_date = now.date()
+
+def next_auto_reset_time(now):
+    """
+    now より後の次回リセット予定時刻を返す
+    """
+    reset_at_hour, reset_at_minute = map(int, config.AUTO_RESET_AT.split(':'))
+    next_time = now.replace(hour=reset_at_hour, minute=reset_at_minute, second=0, microsecond=0)
+    if next_time <= now:
+        next_time += datetime.timedelta(days=1)
+    return next_time
+
+_auto_reset_thread = None
+
+def start_auto_reset_scheduler():
+    """
+    常駐プロセス用: リセット予定時刻に自動リセットを実行するタイマースレッドを開始する
+    """
+    global _auto_reset_thread
+    if _auto_reset_thread is not None:
+        return _auto_reset_thread
+
+    def loop():
+        while True:
+            try:
+                with db.connection_context():
+                    maybe_run_auto_reset()
+            except Exception:
+                # 失敗しても次回の予定時刻に再試行する
+                traceback.print_exc()
+            # 時刻の変更に追従できるよう、最大60秒ごとに残り時間を計算し直す
+            while True:
+                now = datetime.datetime.now()
+                remaining = (next_auto_reset_time(now) - now).total_seconds()
+                if remaining <= 60:
+                    time.sleep(remaining)
+                    break
+                time.sleep(60)
+
+    _auto_reset_thread = threading.Thread(target=loop, name='auto-reset', daemon=True)
+    _auto_reset_thread.start()
+    return _auto_reset_thread
 
 def run_auto_reset(now):
-    # Status.key から Status オブジェクトへのマッピングを作成
-    status_map = {s.key: s for s in Status.select()}
-    
+    """
+    AUTO_RESET_RULES に従って状態を一括更新する
+    戻り値: 更新した件数（ボードのキャッシュの無効化は、呼び出し側でコミット後に行う）
+    """
+    # Status.key から Status オブジェクトを取得
     rules = []
     for from_key, to_key in config.AUTO_RESET_RULES.items():
-        if from_key in status_map and to_key in status_map:
-            rules.append((status_map[from_key], status_map[to_key]))
+        from_status = status_registry.get_by_key(from_key)
+        to_status = status_registry.get_by_key(to_key)
+        if from_status and to_status:
+            rules.append((from_status, to_status))
             
     if not rules:
-        return
+        return 0
         
     # 対象エリアのフィルタリング
     area_ids = []
     if config.AUTO_RESET_SCOPE == "area":
         area_ids = config.AUTO_RESET_AREAS
         
-    total_updated = 0
+    with db.atomic('IMMEDIATE'):
+        total_updated = 0
     
-    # RoomStateの一括更新
-    for from_status, to_status in rules:
-        query = RoomState.update(status=to_status, updated_at=now).where(RoomState.status == from_status)
-        if area_ids:
-            query = query.where(RoomState.room << Room.select(Room.id).where(Room.area << area_ids))
+        # RoomStateの一括更新
+        for from_status, to_status in rules:
+            query = RoomState.update(status=to_status, updated_at=now).where(RoomState.status == from_status)
+            if area_ids:
+                query = query.where(RoomState.room << Room.select(Room.id).where(Room.area << area_ids))
         
-        count = query.execute()
-        total_updated += count
+            count = query.execute()
+            total_updated += count
         
-        if count > 0 and config.AUTO_RESET_LOG_MODE == "per_item":
-            # 個別ログ
-            rooms_to_log = Room.select().join(RoomState).where(RoomState.status == to_status) # 更新後なのでto_status
-            if area_ids:
-                rooms_to_log = rooms_to_log.where(Room.area << area_ids)
+            if count > 0 and config.AUTO_RESET_LOG_MODE == "per_item":
+                # 個別ログ
+                rooms_to_log = Room.select().join(RoomState).where(RoomState.status == to_status) # 更新後なのでto_status
+                if area_ids:
+                    rooms_to_log = rooms_to_log.where(Room.area << area_ids)
                 
-            # 注意: ここでは「今更新されたもの」を厳密に特定するのが難しい（一括更新後なので）
-            # 本来は更新前に取得するか、1つずつ更新する必要があるが、パフォーマンス優先で「サマリーログ」を推奨。
-            # v1.4ではサマリーをデフォルトとする。
-            pass
-
-    # BedStateの一括更新
-    for from_status, to_status in rules:
-        query = BedState.update(status=to_status, updated_at=now).where(BedState.status == from_status)
-        if area_ids:
-            query = query.where(BedState.bed << Bed.select(Bed.id).join(Room).where(Room.area << area_ids))
+                # 注意: ここでは「今更新されたもの」を厳密に特定するのが難しい（一括更新後なので）
+                # 本来は更新前に取得するか、1つずつ更新する必要があるが、パフォーマンス優先で「サマリーログ」を推奨。
+                # v1.4ではサマリーをデフォルトとする。
+                pass
+
+        # BedStateの一括更新
+        for from_status, to_status in rules:
+            query = BedState.update(status=to_status, updated_at=now).where(BedState.status == from_status)
+            if area_ids:
+                query = query.where(BedState.bed << Bed.select(Bed.id).join(Room).where(Room.area << area_ids))
             
-        count = query.execute()
-        total_updated += count
-
-    # 履歴保存 (Summary)
-    if total_updated > 0:
-        StateChangeLog.create(
-            target_type='system',
-            to_status=None, # systemの場合はNoneを許容するか、Metaに書く
-            meta=f"auto_reset: {total_updated} items updated",
-            note=f"自動リセット実行: {total_updated}件更新されました。",
-            changed_at=now
-        )
+            count = query.execute()
+            total_updated += count
+
+        # 一括更新したエリアの集計カウンタを再構築
+        if total_updated > 0:
+            rebuild_counters(area_ids or None)
+
+        # 履歴保存 (Summary)
+        if total_updated > 0:
+            StateChangeLog.create(
+                target_type='system',
+                to_status=None, # systemの場合はNoneを許容するか、Metaに書く
+                meta=f"auto_reset: {total_updated} items updated",
+                note=f"自動リセット実行: {total_updated}件更新されました。",
+                changed_at=now
+            )
+    return total_updated
@@ -6,6 +6,8 @@ from index import create_app
 import models
 import auth
 import config
+import services
+from fragment_cache import fragment_cache
 
 @pytest.fixture(scope="session")
 def db_path():
@@ -18,7 +20,7 @@ def db_path():
     models.db.create_tables([
         models.User, models.Area, models.Room, models.Bed, 
         models.Status, models.RoomState, models.BedState, 
-        models.StateChangeLog, models.SystemJobState
+        models.StateChangeLog, models.SystemJobState, models.OccupancyCounter
     ])
     models.db.close()
     
@@ -46,6 +48,7 @@ def setup_db(db_path):
     # models.db.init(db_path) # 不要：sessionスコープで実施済み
     with models.db:
         # 外部キー制約を考慮した削除順
+        models.OccupancyCounter.delete().execute()
         models.StateChangeLog.delete().execute()
         models.BedState.delete().execute()
         models.RoomState.delete().execute()
@@ -55,6 +58,13 @@ def setup_db(db_path):
         models.User.delete().execute()
         models.Status.delete().execute()
         models.SystemJobState.delete().execute()
+        # IDが再利用されるため、前のテストのボードキャッシュを破棄
+        services.board_cache.clear()
+        services.status_registry.invalidate()
+        fragment_cache.clear()
+        services._auto_reset_done_date = None
+        models.LoginFailure.delete().execute()
+        auth._claim_revision = None
 
         for s in config.INITIAL_STATUSES:
             models.Status.create(**s)
@@ -138,3 +148,62 @@ class AuthHelper:
 @pytest.fixture
 def auth_helper(test_app):
     return AuthHelper(test_app)
+
+class _CountingCursor:
+    # fetch された行数を数えるためのカーソルラッパー
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._counter.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._counter.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._counter.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._counter.rows += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class QueryCounter:
+    """
+    models.db.execute_sql を差し替え、発行クエリ数と取得行数を記録する
+    """
+    def __init__(self):
+        self.queries = []
+        self.rows = 0
+        self._original = None
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def __enter__(self):
+        self._original = models.db.execute_sql
+        def execute_sql(sql, params=None, *args, **kwargs):
+            self.queries.append(sql)
+            cursor = self._original(sql, params, *args, **kwargs)
+            return _CountingCursor(cursor, self)
+        models.db.execute_sql = execute_sql
+        return self
+
+    def __exit__(self, *exc):
+        del models.db.execute_sql
+
+@pytest.fixture
+def query_counter():
+    return QueryCounter
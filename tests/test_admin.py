@@ -98,6 +98,46 @@ def test_admin_status_crud(test_app, admin_user, auth_helper):
     assert "custom_status" in res
     assert Status.select().where(Status.key == "custom_status").exists()
 
+def test_status_registry_invalidation(test_app, admin_user, auth_helper, query_counter, monkeypatch):
+    import services
+    registry = services.status_registry
+    occupied = Status.get(Status.key == "occupied")
+    assert registry.get(occupied.id).label == occupied.label
+    assert registry.occupied_ids() == {occupied.id}
+    assert registry.vacant_ids() == {Status.get(Status.key == "vacant").id}
+
+    # 確認間隔内はDBを読まない
+    with query_counter() as counter:
+        registry.get_by_key("occupied")
+        registry.active()
+    assert counter.count == 0
+
+    # 管理画面での変更は同じプロセスに即時反映される
+    auth_helper.login("admin", "admin")
+    test_app.post(f"/admin/statuses/{occupied.id}/edit", {
+        "key": "occupied",
+        "label": "Renamed",
+        "color_class": occupied.color_class,
+        "icon_class": occupied.icon_class,
+        "sort_order": "0",
+        "applies_to_bed": "on"
+    })
+    assert registry.get(occupied.id).label == "Renamed"
+    assert "Renamed" in test_app.get(f"/board/{Area.create(name='Reg').id}")
+
+    # 他のプロセスでの変更は、DBのバージョンを確認した時点で反映される
+    Status.update(label="Other").where(Status.id == occupied.id).execute()
+    services.bump_cache_version(services.StatusRegistry.VERSION_KEY)
+    assert registry.get(occupied.id).label == "Renamed"
+    monkeypatch.setattr(registry, "check_interval", 0)
+    assert registry.get(occupied.id).label == "Other"
+
+    # 他のプロセスで追加された状態は見つからなければ読み直す
+    monkeypatch.setattr(registry, "check_interval", 3600)
+    added = Status.create(key="added", label="Added", color_class="bg-info", icon_class="bi-star")
+    assert registry.get(added.id).key == "added"
+    assert registry.get("abc") is None
+
 def test_admin_beds_filtering(test_app, admin_user, auth_helper):
     try:
         auth_helper.login("admin", "admin")
@@ -133,3 +173,159 @@ def test_admin_beds_filtering(test_app, admin_user, auth_helper):
     res = test_app.get(f"/admin/beds?area_id={area1.id}&room_id={room1.id}")
     assert "Bed1" in res.text
     assert "Bed2" not in res.text
+
+def _query_plan(query):
+    import models
+    sql, params = query.sql()
+    return " / ".join(row[-1] for row in models.db.execute_sql("EXPLAIN QUERY PLAN " + sql, params))
+
+def test_log_queries_use_indexes(admin_user):
+    import datetime
+    from peewee import Tuple
+    from models import StateChangeLog
+    newest = StateChangeLog.select().order_by(StateChangeLog.changed_at.desc()).limit(200)
+    cases = [
+        (newest, "statechangelog_changed_at"),
+        (newest.where(StateChangeLog.area == 1), "statechangelog_area_id_changed_at"),
+        (newest.where(StateChangeLog.target_type == "bed"), "statechangelog_target_type_changed_at"),
+        (newest.where(StateChangeLog.changed_by == admin_user.id), "statechangelog_changed_by_id_changed_at"),
+        # キーセット方式のページ送り
+        (newest.where(StateChangeLog.area == 1,
+                      Tuple(StateChangeLog.changed_at, StateChangeLog.id) < Tuple(datetime.datetime.now(), 100)),
+         "statechangelog_area_id_changed_at"),
+        (StateChangeLog.delete().where(StateChangeLog.changed_at < datetime.datetime.now()),
+         "statechangelog_changed_at"),
+    ]
+    for query, index in cases:
+        plan = _query_plan(query)
+        assert f"USING INDEX {index}" in plan or f"USING COVERING INDEX {index}" in plan, plan
+        assert "TEMP B-TREE" not in plan, plan
+
+def test_admin_logs_keyset_pagination(test_app, admin_user, auth_helper, query_counter, monkeypatch):
+    import config, datetime, re
+    from models import StateChangeLog, RoomState, BedState
+    monkeypatch.setattr(config, "LOG_PAGE_SIZE", 10)
+    auth_helper.login("admin", "admin")
+    vacant = Status.get(Status.key == "vacant")
+    occupied = Status.get(Status.key == "occupied")
+    area = Area.create(name="LogArea")
+    room = Room.create(area=area, code="L1", name="LogRoom")
+    bed = Bed.create(room=room, code="LB1", name="LogBed")
+    start = datetime.datetime(2026, 1, 1)
+    # 同じ日時の履歴がページの境界をまたいでも重複・欠落しない
+    for i in range(35):
+        StateChangeLog.create(target_type="bed" if i % 2 else "room", room=None if i % 2 else room,
+                              bed=bed if i % 2 else None, area=area, from_status=vacant, to_status=occupied,
+                              changed_by=admin_user, changed_at=start + datetime.timedelta(minutes=i // 3))
+
+    seen, counts = [], []
+    url = "/admin/logs"
+    while url:
+        with query_counter() as counter:
+            res = test_app.get(url)
+        counts.append(counter.count)
+        seen.extend(int(x) for x in re.findall(r'data-log-id="(\d+)"', res.text))
+        assert "LogBed (LogRoom)" in res.text or "LogRoom" in res.text
+        link = res.html.find("a", href=re.compile("before="))
+        url = link["href"] if link else None
+
+    expected = [log.id for log in StateChangeLog.select().order_by(StateChangeLog.changed_at.desc(), StateChangeLog.id.desc())]
+    assert seen == expected
+    assert len(counts) == 4
+    assert len(set(counts)) == 1  # どのページでもクエリ数は一定
+
+    res = test_app.get("/admin/logs?target_type=bed")
+    assert len(re.findall(r'data-log-id="', res.text)) == 10
+    test_app.get("/admin/logs?before=bad", status=400)
+
+def test_purge_logs_in_batches(test_app, admin_user, auth_helper, query_counter, monkeypatch):
+    import config, datetime
+    from models import StateChangeLog
+    monkeypatch.setattr(config, "LOG_RETENTION_DAYS", 30)
+    monkeypatch.setattr(config, "LOG_PURGE_BATCH_SIZE", 7)
+    monkeypatch.setattr(config, "LOG_PURGE_PAUSE", 0)
+    old = datetime.datetime.now() - datetime.timedelta(days=31)
+    StateChangeLog.insert_many([{"target_type": "room", "changed_at": old}] * 20).execute()
+    recent = StateChangeLog.create(target_type="room")
+
+    auth_helper.login("admin", "admin")
+    with query_counter() as counter:
+        res = test_app.post("/admin/logs/purge").follow()
+    assert "20件のログを削除しました" in res.text
+    assert [log.id for log in StateChangeLog.select()] == [recent.id]
+    # 7件ずつ3回に分けて削除される
+    assert sum(1 for sql in counter.queries if sql.startswith("DELETE")) == 3
+
+def test_purge_logs_keeps_newest_id(monkeypatch):
+    import config, datetime, services
+    from models import StateChangeLog
+    monkeypatch.setattr(config, "LOG_RETENTION_DAYS", 30)
+    monkeypatch.setattr(config, "LOG_PURGE_PAUSE", 0)
+    old = datetime.datetime.now() - datetime.timedelta(days=31)
+    StateChangeLog.insert_many([{"target_type": "room", "changed_at": old}] * 3).execute()
+    newest = StateChangeLog.select(StateChangeLog.id).order_by(StateChangeLog.id.desc()).first().id
+
+    # 全件が保持期間を過ぎていても最新の1件は残し、次の履歴の id が再利用されない
+    assert services.purge_logs()['rows'] == 2
+    assert [log.id for log in StateChangeLog.select()] == [newest]
+    assert StateChangeLog.create(target_type="room").id > newest
+
+def test_purge_logs_reclaims_pages(db_path, tmp_path, monkeypatch):
+    import config, datetime, models, services
+    monkeypatch.setattr(config, "LOG_RETENTION_DAYS", 30)
+    monkeypatch.setattr(config, "LOG_PURGE_PAUSE", 0)
+    old = datetime.datetime.now() - datetime.timedelta(days=31)
+    try:
+        models.init_db(str(tmp_path / "purge.db"))
+        with models.db.connection_context():
+            assert models.db.pragma('auto_vacuum') == 2  # 新規作成のDBは incremental
+            models.StateChangeLog.insert_many(
+                [{"target_type": "bed", "changed_at": old, "note": "x" * 200}] * 2000).execute()
+            pages = models.db.pragma('page_count')
+            result = services.purge_logs()
+            assert result["rows"] == 1999  # 最新の1件は id の再利用を防ぐために残る
+            assert result["pages"] > 0
+            assert models.db.pragma('page_count') <= pages - result["pages"]
+    finally:
+        models.db.init(db_path)
+
+def test_archived_logs_read_through(test_app, admin_user, auth_helper, db_path, tmp_path, query_counter, monkeypatch):
+    import config, datetime, re, models, services
+    from models import StateChangeLog, ArchivedStateChangeLog
+    monkeypatch.setattr(config, "LOG_ARCHIVE_ENABLED", True)
+    monkeypatch.setattr(config, "LOG_ARCHIVE_PATH", str(tmp_path / "archive.db"))
+    monkeypatch.setattr(config, "LOG_HOT_DAYS", 30)
+    monkeypatch.setattr(config, "LOG_PAGE_SIZE", 10)
+    monkeypatch.setattr(config, "LOG_PURGE_PAUSE", 0)
+    vacant = Status.get(Status.key == "vacant")
+    area = Area.create(name="ArchiveArea")
+    room = Room.create(area=area, code="A1", name="ArchiveRoom")
+    now = datetime.datetime.now()
+    for days in (60, 50, 45, 40, 35, 25, 20, 15, 10, 5, 3, 1):
+        StateChangeLog.create(target_type="room", room=room, area=area, to_status=vacant,
+                              changed_by=admin_user, changed_at=now - datetime.timedelta(days=days))
+    expected = [log.id for log in StateChangeLog.select().order_by(StateChangeLog.changed_at.desc())]
+    try:
+        models.init_db(db_path)
+        with models.db.connection_context():
+            result = services.archive_logs()
+            assert result["rows"] == 5  # 30日より古い5件
+            assert StateChangeLog.select().count() == 7
+            assert ArchivedStateChangeLog.select().count() == 5
+            # 再実行しても重複しない
+            assert services.archive_logs()["rows"] == 0
+
+        auth_helper.login("admin", "admin")
+        # 1ページ目が本体のDBだけで埋まる場合はアーカイブを読まない
+        monkeypatch.setattr(config, "LOG_PAGE_SIZE", 5)
+        with query_counter() as counter:
+            first = test_app.get("/admin/logs")
+        assert not any('"archive"' in sql for sql in counter.queries)
+        second = test_app.get(first.html.find("a", href=re.compile("before="))["href"])
+        third = test_app.get(second.html.find("a", href=re.compile("before="))["href"])
+        seen = [int(x) for res in (first, second, third) for x in re.findall(r'data-log-id="(\d+)"', res.text)]
+        assert seen == expected
+        assert "ArchiveRoom" in third.text and "ArchiveArea" in third.text
+    finally:
+        monkeypatch.setattr(config, "LOG_ARCHIVE_ENABLED", False)
+        models.init_db(db_path)
@@ -107,3 +107,122 @@ def test_inactive_user_cannot_login(test_app):
     res = form.submit()
     
     assert "IDまたはパスワードが正しくありません" in res
+
+def _user_queries(counter):
+    return [q for q in counter.queries if 'FROM "user"' in q]
+
+def test_current_user_resolved_once_per_request(test_app, operator_user, auth_helper, query_counter):
+    from models import Area
+    area = Area.create(name="A")
+    auth_helper.login("operator", "operatorpass")
+
+    with query_counter() as counter:
+        test_app.get(f"/board/{area.id}")
+    assert len(_user_queries(counter)) == 1
+
+def test_session_claim_skips_user_lookup(test_app, viewer_user, auth_helper, query_counter, monkeypatch):
+    import config
+    import auth
+    monkeypatch.setattr(config, "SESSION_CLAIM_TTL", 60)
+    auth_helper.login("viewer", "viewerpass")
+
+    test_app.get("/summary")  # claim の発行
+    with query_counter() as counter:
+        res = test_app.get("/summary")
+    assert res.status_code == 200
+    assert "viewer (viewer)" in res
+    assert _user_queries(counter) == []
+
+    # 失効カウンタが上がると再取得され、無効化されたユーザーは締め出される
+    viewer_user.is_active = False
+    viewer_user.save()
+    auth.revoke_claims()
+    res = test_app.get("/summary", status=302)
+    assert "/login" in res.headers['Location']
+
+def test_session_claim_revoked_by_other_process(test_app, viewer_user, auth_helper, monkeypatch):
+    import config
+    import auth
+    import services
+    monkeypatch.setattr(config, "SESSION_CLAIM_TTL", 60)
+    monkeypatch.setattr(config, "SESSION_CLAIM_CHECK_INTERVAL", 0)
+    auth_helper.login("viewer", "viewerpass")
+    test_app.get("/summary")  # claim の発行
+
+    # 他のプロセス（または再起動前）での失効もDBの失効カウンタで反映される
+    viewer_user.is_active = False
+    viewer_user.save()
+    services.bump_cache_version(auth.CLAIM_VERSION_KEY)
+    res = test_app.get("/summary", status=302)
+    assert "/login" in res.headers['Location']
+
+def test_session_claim_expires(test_app, viewer_user, auth_helper, query_counter, monkeypatch):
+    import config
+    from freezegun import freeze_time
+    monkeypatch.setattr(config, "SESSION_CLAIM_TTL", 60)
+    auth_helper.login("viewer", "viewerpass")
+
+    with freeze_time("2026-01-16 10:00:00"):
+        test_app.get("/summary")
+    with freeze_time("2026-01-16 10:02:00"):
+        with query_counter() as counter:
+            test_app.get("/summary")
+    assert len(_user_queries(counter)) == 1
+
+def test_login_throttled_after_failures(test_app, monkeypatch):
+    import auth
+    import config
+    from models import LoginFailure
+    monkeypatch.setattr(config, "LOGIN_MAX_FAILURES", 3)
+    calls = []
+    original = auth.verify_password
+    monkeypatch.setattr(auth, "verify_password", lambda *args: calls.append(1) or original(*args))
+
+    def attempt(password, status=200):
+        return test_app.post("/login", {"username": "admin", "password": password}, status=status)
+
+    for _ in range(3):
+        attempt("wrongpass")
+    assert len(calls) == 3
+
+    # 上限到達後は正しいパスワードでもハッシュ計算を行わずに拒否
+    res = attempt("admin", status=429)
+    assert "しばらくしてから" in res
+    assert len(calls) == 3
+
+    # 他のユーザーは影響を受けない
+    LoginFailure.delete().where(LoginFailure.kind == 'ip').execute()
+    res = test_app.post("/login", {"username": "someone", "password": "x"})
+    assert "IDまたはパスワードが正しくありません" in res
+
+def test_login_failures_shared_and_pruned(test_app, monkeypatch):
+    import auth
+    import config
+    from freezegun import freeze_time
+    from models import LoginFailure
+    monkeypatch.setattr(config, "LOGIN_MAX_FAILURES", 2)
+    monkeypatch.setattr(config, "LOGIN_FAILURE_WINDOW", 60)
+
+    # 失敗はDBに記録されるため、別のプロセス（CGI の次のリクエスト）でも数えられる
+    with freeze_time("2026-01-16 10:00:00"):
+        auth.record_login_failure("admin", "10.0.0.1")
+        auth.record_login_failure("admin", "10.0.0.2")
+        assert auth.is_login_throttled("admin", "10.0.0.3")
+        assert not auth.is_login_throttled("other", "10.0.0.1")
+
+    # 期間を過ぎた失敗は数えず、次の失敗の記録時に削除される
+    with freeze_time("2026-01-16 10:01:01"):
+        assert not auth.is_login_throttled("admin", "10.0.0.3")
+        auth.record_login_failure("other", "10.0.0.9")
+    assert LoginFailure.select().count() == 2
+
+def test_login_rejected_when_verify_queue_full(test_app, monkeypatch):
+    import threading
+    import auth
+    monkeypatch.setattr(auth, "_verify_slots", threading.BoundedSemaphore(1))
+    auth._verify_slots.acquire()
+    res = test_app.post("/login", {"username": "admin", "password": "admin"}, status=503)
+    assert "混み合っています" in res
+
+    auth._verify_slots.release()
+    test_app.post("/login", {"username": "admin", "password": "admin"}, status=302)
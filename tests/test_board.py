@@ -1,4 +1,5 @@
 import pytest
+import config
 from models import Area, Room, Bed, Status, RoomState, BedState, StateChangeLog
 
 @pytest.fixture
@@ -103,3 +104,514 @@ def test_display_board(test_app, sample_data):
     res = test_app.get(f"/display/board/{area.id}")
     assert res.status_code == 200
     assert "Area-W" in res
+
+def test_board_data_is_scoped_to_area(query_counter):
+    import services
+
+    vacant = Status.get(Status.key == "vacant")
+
+    def add_area(name, rooms=2, beds=3):
+        area = Area.create(name=name)
+        for r in range(rooms):
+            room = Room.create(area=area, code=f"{name}-{r}", name=f"{name}-R{r}", sort_order=r)
+            RoomState.create(room=room, status=vacant)
+            for b in range(beds):
+                bed = Bed.create(room=room, code=f"{name}-{r}-{b}", name=f"B{b}", sort_order=b)
+                BedState.create(bed=bed, status=vacant)
+        return area
+
+    target = add_area("Target")
+
+    # 状態マスタはプロセス内のキャッシュ（status_registry）から割り当てられる
+    services.status_registry.active()
+
+    def measure():
+        services.board_cache.clear()
+        with query_counter() as counter:
+            data = services.get_board_data(target.id)
+        return counter.count, counter.rows, data
+
+    base_queries, base_rows, data = measure()
+    assert [len(d.beds) for d in data] == [3, 3]
+    assert data[0].beds[0].cell.key == "vacant"
+
+    # 他エリアが増えてもクエリ数・取得行数は変わらない
+    for i in range(5):
+        add_area(f"Other{i}", rooms=3, beds=4)
+    queries, rows, data = measure()
+    assert base_queries == queries == 1
+    assert rows == base_rows
+    assert [len(d.beds) for d in data] == [3, 3]
+
+def test_board_data_room_without_beds(sample_data):
+    import services
+    area, room, bed = sample_data
+    empty_room = Room.create(area=area, code="W102", name="Room-102", sort_order=1)
+    inactive_bed = Bed.create(room=room, code="W101-B", name="Bed-B", is_active=False)
+
+    data = services.get_board_data(area.id)
+    assert [d.id for d in data] == [room.id, empty_room.id]
+    assert [b.id for b in data[0].beds] == [bed.id]
+    assert data[0].beds[0].cell.status_id is None
+    assert data[1].beds == ()
+    assert data[1].cell.status_id is None
+
+def test_bed_counts_from_counters(query_counter):
+    import services
+    occupied = Status.get(Status.key == "occupied")
+    vacant = Status.get(Status.key == "vacant")
+
+    areas = []
+    for i in range(3):
+        area = Area.create(name=f"Count{i}", sort_order=i)
+        room = Room.create(area=area, code=f"C{i}", name=f"C{i}")
+        BedState.create(bed=Bed.create(room=room, code="1", name="1"), status=occupied)
+        BedState.create(bed=Bed.create(room=room, code="2", name="2"), status=vacant)
+        Bed.create(room=room, code="3", name="3")
+        Bed.create(room=room, code="4", name="4", is_available=False)
+        Bed.create(room=room, code="5", name="5", is_active=False)
+        areas.append(area)
+    Area.create(name="NoBeds", sort_order=9)
+    # テストデータはモデルを直接作成しているため集計カウンタを構築しておく
+    services.rebuild_counters()
+    services.status_registry.active()
+
+    with query_counter() as counter:
+        results = services.get_bed_counts()
+    assert counter.count == 1
+
+    assert [r['area'].name for r in results] == ["Count0", "Count1", "Count2", "NoBeds"]
+    first = results[0]
+    assert first['total_available_beds'] == 3
+    assert first['unavailable_beds'] == 1
+    assert first['occupied_beds'] == 1
+    assert first['vacant_beds'] == 2
+    assert results[3]['total_available_beds'] == 0
+
+    totals = services.get_bed_totals(results)
+    assert totals['total_available_beds'] == 9
+    assert totals['occupied_beds'] == 3
+    assert totals['unavailable_beds'] == 3
+
+    single = services.get_bed_counts(areas[1].id)
+    assert [r['area'].id for r in single] == [areas[1].id]
+
+def test_counters_follow_state_updates(admin_user):
+    import services
+    occupied = Status.get(Status.key == "occupied")
+    cleaning = Status.get(Status.key == "cleaning")
+    area = Area.create(name="Counters")
+    room = Room.create(area=area, code="C1", name="C1")
+    bed1 = Bed.create(room=room, code="1", name="1")
+    bed2 = Bed.create(room=room, code="2", name="2", is_available=False)
+    services.rebuild_counters()
+    assert services.check_counters() == []
+
+    services.update_bed_state(bed1.id, occupied.id, admin_user)
+    services.update_bed_state(bed2.id, cleaning.id, admin_user)
+    services.update_bed_state(bed1.id, cleaning.id, admin_user)
+    services.update_bed_state(bed1.id, occupied.id, admin_user)
+    assert services.check_counters() == []
+
+    counts = services.get_bed_counts(area.id)[0]
+    assert counts['occupied_beds'] == 1
+    assert counts['unavailable_beds'] == 1
+
+    # 直接書き換えるとずれを検出でき、再構築で修復できる
+    BedState.update(status=cleaning).where(BedState.bed == bed1).execute()
+    drift = services.check_counters()
+    assert {(d['status_id'], d['expected'], d['actual']) for d in drift} == {
+        (occupied.id, 0, 1), (cleaning.id, 1, 0)}
+    services.rebuild_counters([area.id])
+    assert services.check_counters() == []
+
+def test_state_update_statements(admin_user, sample_data, query_counter):
+    import services
+    area, room, bed = sample_data
+    occupied = Status.get(Status.key == "occupied")
+    cleaning = Status.get(Status.key == "cleaning")
+    services.rebuild_counters()
+    services.status_registry.active()
+
+    # 取得（部屋・エリアは結合）・UPSERT・履歴の3文。ベッドは状態が変わるとカウンタ更新が1文加わる
+    for status, expected in ((occupied, 4), (occupied, 3), (cleaning, 4)):
+        with query_counter() as counter:
+            services.update_bed_state(bed.id, status.id, admin_user)
+        assert counter.count == expected, counter.queries
+    with query_counter() as counter:
+        services.update_room_state(room.id, occupied.id, admin_user)
+    assert counter.count == 3, counter.queries
+
+    assert BedState.get(BedState.bed == bed).status_id == cleaning.id
+    assert RoomState.get(RoomState.room == room).status_id == occupied.id
+    assert services.check_counters() == []
+    froms = [log.from_status_id for log in StateChangeLog.select().where(StateChangeLog.bed == bed).order_by(StateChangeLog.id)]
+    assert froms == [None, occupied.id, occupied.id]
+
+    with pytest.raises(Bed.DoesNotExist):
+        services.update_bed_state(9999, occupied.id, admin_user)
+    with pytest.raises(Status.DoesNotExist):
+        services.update_room_state(room.id, 9999, admin_user)
+    assert StateChangeLog.select().count() == 4
+
+def test_counter_checks_count_inside_transaction(monkeypatch):
+    import services
+    from models import db
+    # 集計と書き換え（比較）の間に他の状態変更が割り込まないよう、同じトランザクション内で集計する
+    count = services._count_beds_by_status
+    calls = []
+    monkeypatch.setattr(services, "_count_beds_by_status",
+                        lambda *args: calls.append(db.in_transaction()) or count(*args))
+    services.rebuild_counters()
+    assert services.check_counters() == []
+    assert calls == [True, True]
+
+def test_admin_bed_edits_update_counters(test_app, auth_helper):
+    import services
+    auth_helper.login("admin", "admin")
+    area = Area.create(name="AdminCounters")
+    room = Room.create(area=area, code="A1", name="A1")
+    services.rebuild_counters()
+
+    test_app.post("/admin/beds/new", {
+        "room_id": str(room.id), "code": "A1-1", "name": "A1-1",
+        "sort_order": "0", "is_available": "on"
+    })
+    bed = Bed.get(Bed.code == "A1-1")
+    assert services.get_bed_counts(area.id)[0]['total_available_beds'] == 1
+
+    test_app.post(f"/admin/beds/{bed.id}/edit", {
+        "room_id": str(room.id), "code": "A1-1", "name": "A1-1", "sort_order": "0"
+    })
+    counts = services.get_bed_counts(area.id)[0]
+    assert counts['total_available_beds'] == 0
+    assert counts['unavailable_beds'] == 1
+
+    test_app.post(f"/admin/beds/{bed.id}/toggle_active")
+    counts = services.get_bed_counts(area.id)[0]
+    assert counts['unavailable_beds'] == 0
+    assert services.check_counters() == []
+
+def test_board_cache_hits_until_state_changes(admin_user, query_counter, sample_data, monkeypatch):
+    import services
+    # 既定（None）では serve.py の1プロセスでのみ有効
+    assert not config.BOARD_CACHE_ENABLED
+    monkeypatch.setattr(config, "BOARD_CACHE_ENABLED", True)
+    area, room, bed = sample_data
+    occupied = Status.get(Status.key == "occupied")
+
+    first = services.get_board_data(area.id)
+    with query_counter() as counter:
+        again = services.get_board_data(area.id)
+    assert counter.count == 0
+    assert again is first
+    assert services.board_cache.stats()['hits'] == 1
+
+    services.update_bed_state(bed.id, occupied.id, admin_user)
+    updated = services.get_board_data(area.id)
+    assert updated is not first
+    assert updated[0].beds[0].cell.key == "occupied"
+
+def test_board_cache_is_bounded():
+    import services
+    cache = services.BoardCache(max_areas=2)
+    for area_id in (1, 2, 3):
+        cache.put(area_id, cache.version(area_id), [area_id])
+    assert cache.get(1) is None
+    assert cache.get(3) == [3]
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 2}
+
+    # 読み込み中にバージョンが上がった場合、古いデータはヒットしない
+    version = cache.version(2)
+    cache.bump(2)
+    cache.put(2, version, ["stale"])
+    assert cache.get(2) is None
+
+    cache.bump()
+    assert cache.get(3) is None
+
+def test_display_board_conditional_get(test_app, admin_user, sample_data):
+    import services
+    area, room, bed = sample_data
+    res = test_app.get(f"/display/board/{area.id}")
+    etag = res.headers['ETag']
+    last_modified = res.headers['Last-Modified']
+
+    res = test_app.get(f"/display/board/{area.id}", headers={"If-None-Match": etag}, status=304)
+    assert res.body == b""
+    test_app.get(f"/display/board/{area.id}", headers={"If-Modified-Since": last_modified}, status=304)
+
+    # 状態が変わると再描画される
+    occupied = Status.get(Status.key == "occupied")
+    services.update_bed_state(bed.id, occupied.id, admin_user)
+    res = test_app.get(f"/display/board/{area.id}", headers={"If-None-Match": etag}, status=200)
+    assert res.headers['ETag'] != etag
+    assert "使用中" in res
+
+    # テーマが変わっても再描画される
+    test_app.set_cookie('theme', 'dark')
+    test_app.get(f"/display/board/{area.id}", headers={"If-None-Match": res.headers['ETag']}, status=200)
+
+def test_board_conditional_get(test_app, operator_user, auth_helper, sample_data):
+    area, room, bed = sample_data
+    auth_helper.login("operator", "operatorpass")
+    res = test_app.get(f"/board/{area.id}")
+    etag = res.headers['ETag']
+    test_app.get(f"/board/{area.id}", headers={"If-None-Match": etag}, status=304)
+
+    room.name = "Room-101b"
+    room.save()
+    test_app.get(f"/board/{area.id}", headers={"If-None-Match": etag}, status=200)
+
+def test_display_board_push_events(test_app, admin_user, sample_data, monkeypatch):
+    import json
+    import services
+    area, room, bed = sample_data
+    occupied = Status.get(Status.key == "occupied")
+
+    test_app.get(f"/display/board/{area.id}/events", status=404)
+
+    monkeypatch.setattr(config, "DISPLAY_PUSH_ENABLED", True)
+    monkeypatch.setattr(config, "DISPLAY_PUSH_MAX_DURATION", 0)
+    res = test_app.get(f"/display/board/{area.id}")
+    assert "/events" in res
+    assert '<noscript><meta http-equiv="refresh"' in res
+
+    # ベッドを追加する前の部屋の状態が残っていても、表示されないマスは送らない
+    services.update_room_state(room.id, occupied.id, admin_user)
+    services.update_bed_state(bed.id, occupied.id, admin_user)
+    res = test_app.get(f"/display/board/{area.id}/events")
+    assert res.content_type == "text/event-stream"
+    event = [block for block in res.text.split("\n\n") if "event: cells" in block][0]
+    assert event.startswith("id: ")
+    payload = json.loads(event.split("data: ", 1)[1])
+    assert payload['initial'] is True
+    assert payload['cells'] == [dict(payload['cells'][0], type='bed', id=bed.id, room_id=room.id, key='occupied')]
+    # 状態の変更では構成の署名は変わらない（画面に埋め込んだ値と同じ）
+    page_layout = services.get_board_layout_version(area.id)
+    assert payload['layout'] == page_layout
+    assert f"const layoutVersion = {json.dumps(page_layout)}" in test_app.get(f"/display/board/{area.id}").text
+
+    # 履歴に残らない変更（名称変更）も、再接続後の生存確認で構成の署名が変わったことを通知する
+    monkeypatch.setattr(config, "DISPLAY_PUSH_HEARTBEAT", 0)
+    room.name = "Renamed"
+    room.save()
+    res = test_app.get(f"/display/board/{area.id}/events", headers={"Last-Event-ID": event.split("\n", 1)[0][4:]})
+    ping = [block for block in res.text.split("\n\n") if "event: ping" in block][0]
+    assert json.loads(ping.split("data: ", 1)[1])['layout'] not in (None, page_layout)
+
+def test_board_changes_api(test_app, admin_user, sample_data):
+    area, room, bed = sample_data
+    occupied = Status.get(Status.key == "occupied")
+    vacant = Status.get(Status.key == "vacant")
+    other_room = Room.create(area=Area.create(name="Other"), code="O1", name="O1")
+    # 部屋の状態のマスはベッドがない部屋のみ
+    bedless = Room.create(area=area, code="W102", name="Room-102")
+    import services
+
+    res = test_app.get(f"/api/board/{area.id}/changes").json
+    assert res['full'] is True
+    cursor = res['cursor']
+
+    services.update_room_state(room.id, vacant.id, admin_user)
+    services.update_room_state(bedless.id, vacant.id, admin_user)
+    services.update_room_state(other_room.id, vacant.id, admin_user)
+    res = test_app.get(f"/api/board/{area.id}/changes?since={cursor}").json
+    assert res['full'] is False
+    assert [r['id'] for r in res['rooms']] == [bedless.id]
+    assert res['beds'] == []
+    cursor = res['cursor']
+
+    services.update_bed_state(bed.id, occupied.id, admin_user)
+    res = test_app.get(f"/api/board/{area.id}/changes?since={cursor}").json
+    assert [(b['id'], b['key']) for b in res['beds']] == [(bed.id, 'occupied')]
+    assert res['rooms'] == []
+
+    # 変更がなければ空
+    res = test_app.get(f"/api/board/{area.id}/changes?since={res['cursor']}").json
+    assert res['rooms'] == [] and res['beds'] == []
+
+    # エリアを特定できない変更（自動リセット）があれば全件を返す
+    StateChangeLog.create(target_type='system', meta="auto_reset")
+    res = test_app.get(f"/api/board/{area.id}/changes?since={res['cursor']}").json
+    assert res['full'] is True
+    assert len(res['rooms']) == 1 and len(res['beds']) == 1
+
+    test_app.get(f"/api/board/{area.id}/changes?since=abc", status=400)
+
+def test_write_behind_change_log(admin_user, tmp_path, monkeypatch, query_counter):
+    import services, log_writer
+    from models import StateChangeLog
+    occupied = Status.get(Status.key == "occupied")
+    area = Area.create(name="WriteBehind")
+    room = Room.create(area=area, code="W1", name="W1")
+    beds = [Bed.create(room=room, code=str(i), name=str(i)) for i in range(5)]
+
+    writer = log_writer.LogWriter(str(tmp_path), batch_size=100)
+    monkeypatch.setattr(services, "_log_writer", writer)
+    with query_counter() as counter:
+        for bed in beds:
+            services.update_bed_state(bed.id, occupied.id, admin_user)
+        services.update_room_state(room.id, occupied.id, admin_user)
+    # 状態変更では履歴を書き込まず、スプールに追記するだけ
+    assert not any("statechangelog" in sql for sql in counter.queries)
+    assert StateChangeLog.select().count() == 0
+    with open(writer.spool_path) as f:
+        assert len(f.read().splitlines()) == 6
+
+    with query_counter() as counter:
+        assert writer.flush() == 6
+    assert sum(1 for sql in counter.queries if sql.startswith('INSERT INTO "statechangelog"')) == 1
+    logs = list(StateChangeLog.select().order_by(StateChangeLog.id))
+    assert [log.bed_id for log in logs[:5]] == [bed.id for bed in beds]
+    assert logs[5].target_type == "room" and logs[5].area_id == area.id
+    assert list(tmp_path.iterdir()) == []  # 書き込み済みのスプールは削除される
+
+def test_write_behind_recovers_spool(admin_user, tmp_path):
+    import datetime, json, subprocess, sys, log_writer
+    from models import StateChangeLog
+    occupied = Status.get(Status.key == "occupied")
+    # 終了済みのプロセスのスプール（1件目は書き込み済み、最後の行は書き込み途中）
+    dead_pid = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                              capture_output=True, text=True).stdout.strip()
+    rows = [{"target_type": "bed", "room": None, "bed": i, "area": None, "from_status": None,
+             "to_status": occupied.id, "changed_by": admin_user.id,
+             "changed_at": datetime.datetime(2026, 1, 1, 0, 0, i), "note": None, "meta": None}
+            for i in range(1, 4)]
+    StateChangeLog.insert(rows[0]).execute()
+    lines = [json.dumps(dict(r, changed_at=r["changed_at"].isoformat())) for r in rows]
+    (tmp_path / f"changelog-{dead_pid}.1.jsonl").write_text("\n".join(lines) + '\n{"target_ty')
+
+    writer = log_writer.LogWriter(str(tmp_path))
+    assert writer.recover() == 2
+    assert writer.recover() == 0
+    assert sorted(log.bed_id for log in StateChangeLog.select()) == [1, 2, 3]
+    assert list(tmp_path.iterdir()) == []
+
+def test_write_behind_recover_claims_spool(admin_user, tmp_path, monkeypatch):
+    import datetime, json, os, subprocess, sys, log_writer
+    from models import StateChangeLog
+    occupied = Status.get(Status.key == "occupied")
+    dead_pid = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                              capture_output=True, text=True).stdout.strip()
+    row = {"target_type": "bed", "room": None, "bed": 1, "area": None, "from_status": None,
+           "to_status": occupied.id, "changed_by": admin_user.id,
+           "changed_at": "2026-01-01T00:00:01", "note": None, "meta": None}
+    first = tmp_path / f"changelog-{dead_pid}.1.jsonl"
+    second = tmp_path / f"changelog-{dead_pid}.2.jsonl"
+    first.write_text(json.dumps(row) + "\n")
+    second.write_text(json.dumps(dict(row, bed=2)) + "\n")
+
+    # 一覧の取得後に他のワーカーが1つ目を先に復元した場合でも、落ちずに残りを復元する
+    glob = log_writer.glob.glob
+    def racing_glob(pattern):
+        paths = glob(pattern)
+        os.rename(first, tmp_path / "changelog-0.recover1.jsonl")
+        return paths
+    monkeypatch.setattr(log_writer.glob, "glob", racing_glob)
+    writer = log_writer.LogWriter(str(tmp_path))
+    assert writer.recover() == 1
+    assert [log.bed_id for log in StateChangeLog.select()] == [2]
+    assert [p.name for p in tmp_path.iterdir()] == ["changelog-0.recover1.jsonl"]
+
+def test_bulk_update_states(test_app, operator_user, auth_helper, query_counter):
+    import services
+    occupied = Status.get(Status.key == "occupied")
+    cleaning = Status.get(Status.key == "cleaning")
+    area = Area.create(name="Bulk")
+    room = Room.create(area=area, code="B1", name="B1")
+    beds = [Bed.create(room=room, code=str(i), name=str(i)) for i in range(20)]
+    beds[0].is_available = False
+    beds[0].save()
+    single = Room.create(area=area, code="B2", name="B2")
+    services.rebuild_counters()
+    services.update_bed_state(beds[1].id, cleaning.id, operator_user)
+
+    auth_helper.login("operator", "operatorpass")
+    csrf_token = auth_helper.get_csrf_token(f"/board/{area.id}")
+    with query_counter() as counter:
+        res = test_app.post("/state/bulk", {
+            "status_id": occupied.id,
+            "area_id": area.id,
+            "bed_id": [b.id for b in beds],
+            "room_id": [single.id],
+            "csrf_token": csrf_token
+        })
+    assert res.status_code == 302
+
+    # 件数によらず、履歴の INSERT は1回にまとまる
+    inserts = [q for q in counter.queries if q.startswith('INSERT INTO "statechangelog"')]
+    assert len(inserts) == 1
+    assert BedState.select().where(BedState.status == occupied).count() == 20
+    assert RoomState.get(RoomState.room == single).status_id == occupied.id
+    assert services.check_counters() == []
+    logs = StateChangeLog.select().where(StateChangeLog.to_status == occupied)
+    assert logs.count() == 21
+    assert StateChangeLog.get(StateChangeLog.bed == beds[1], StateChangeLog.to_status == occupied).from_status_id == cleaning.id
+
+def test_room_card_fragment_cache(test_app, admin_user, operator_user, auth_helper):
+    import services
+    from fragment_cache import fragment_cache
+    occupied = Status.get(Status.key == "occupied")
+    area = Area.create(name="Fragments")
+    rooms = [Room.create(area=area, code=f"F{i}", name=f"F{i}", sort_order=i) for i in range(4)]
+    beds = [Bed.create(room=room, code=f"{room.code}-1", name="1") for room in rooms]
+
+    test_app.get(f"/display/board/{area.id}")
+    assert fragment_cache.stats()['misses'] == 4
+
+    # 1部屋だけ変わった場合は、その部屋のカードのみ描画し直す
+    services.update_bed_state(beds[2].id, occupied.id, admin_user)
+    res = test_app.get(f"/display/board/{area.id}")
+    assert fragment_cache.stats() == {'hits': 3, 'misses': 5, 'size': 5}
+    assert res.html.find(attrs={"data-cell": f"bed-{beds[2].id}"})['data-color'] == occupied.color_class
+
+    # 状態マスタの変更や表示設定・権限の違いは別のキーになる
+    Status.update(label="Renamed").where(Status.id == occupied.id).execute()
+    services.invalidate_statuses()
+    assert "Renamed" in test_app.get(f"/display/board/{area.id}")
+    auth_helper.login("operator", "operatorpass")
+    res = test_app.get(f"/board/{area.id}")
+    assert res.html.find(attrs={"data-type": "bed", "data-id": str(beds[0].id)}) is not None
+
+def test_room_view_model(test_app, monkeypatch):
+    import datetime
+    import services
+    status = {s.key: s for s in Status.select()}
+    area = Area.create(name="View")
+    mixed = Room.create(area=area, code="V1", name="V1", sort_order=1)
+    empty = Room.create(area=area, code="V2", name="V2", sort_order=2)
+    vacant_room = Room.create(area=area, code="V3", name="V3", sort_order=3)
+    unset_room = Room.create(area=area, code="V4", name="V4", sort_order=4)
+    t1 = datetime.datetime(2026, 1, 1, 9, 0)
+    t2 = datetime.datetime(2026, 1, 1, 10, 30)
+    for key, updated_at in (("occupied", t1), ("cleaning", t2), ("vacant", t1), (None, None)):
+        bed = Bed.create(room=mixed, code=f"V1-{key}", name=str(key))
+        if key:
+            # save() は updated_at を現在時刻にするため insert で作成する
+            BedState.insert(bed=bed, status=status[key], updated_at=updated_at).execute()
+    BedState.insert(bed=Bed.create(room=empty, code="V2-1", name="1"), status=status["vacant"], updated_at=t1).execute()
+    Bed.create(room=empty, code="V2-2", name="2")
+    RoomState.insert(room=vacant_room, status=status["vacant"], updated_at=t2).execute()
+
+    data = services.get_board_data(area.id)
+    assert [d.is_empty for d in data] == [False, True, True, False]
+    assert [d.last_update for d in data] == [t2, t1, t2, None]
+    assert data[0].counts == (4, 1, 2)
+    assert data[1].counts == (2, 0, 2)
+    assert data[2].counts._asdict() == {'beds': 0, 'occupied': 0, 'vacant': 1}
+    assert [b.cell.key for b in data[0].beds] == ["occupied", "cleaning", "vacant", None]
+    unset = data[0].beds[3].cell
+    assert (unset.key, unset.label, unset.color_class, unset.icon_class) == (None, '未設定', None, 'bi-question-circle')
+    assert data[2].cell.color_class == status["vacant"].color_class
+
+    # Status は id で参照するため、状態マスタの変更はボードデータを作り直さずに反映される
+    Status.update(label="Renamed").where(Status.key == "occupied").execute()
+    services.invalidate_statuses()
+    assert data[0].beds[0].cell.label == "Renamed"
+
+    # 空室非表示では空室を除外し、その件数を表示する
+    monkeypatch.setattr(config, "DISPLAY_HIDE_EMPTY_ROOMS", True)
+    res = test_app.get(f"/display/board/{area.id}")
+    assert [card.get_text(" ", strip=True).split()[:2] for card in res.html.select(".room-name")] == [["V1", "V1"], ["V4", "V4"]]
+    assert "空き状態の部屋を 2 件非表示にしています。" in res
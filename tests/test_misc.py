@@ -57,3 +57,209 @@ def test_theme_switch(test_app):
     
     res = test_app.get("/theme/light").follow()
     assert test_app.cookies['theme'] == 'light'
+
+def test_auto_reset_runs_once_per_day(admin_user, query_counter, monkeypatch):
+    import services
+    from models import StateChangeLog
+    monkeypatch.setattr(config, "AUTO_RESET_ENABLED", True)
+    monkeypatch.setattr(config, "AUTO_RESET_RULES", {"cleaning": "vacant"})
+    monkeypatch.setattr(config, "AUTO_RESET_AT", "04:00")
+
+    area = Area.create(name="ResetArea")
+    room = Room.create(area=area, code="R1", name="Room1")
+    cleaning_status = Status.get(Status.key == "cleaning")
+    RoomState.create(room=room, status=cleaning_status)
+
+    with freeze_time("2026-01-16 05:00:00"):
+        maybe_run_auto_reset()
+        assert StateChangeLog.select().where(StateChangeLog.target_type == 'system').count() == 1
+
+        # 同じプロセスでの2回目以降はDBにアクセスしない
+        with query_counter() as counter:
+            maybe_run_auto_reset()
+        assert counter.count == 0
+
+        # 別プロセス（実行済みの記憶なし）でもDB上の実行記録により二重実行しない
+        RoomState.update(status=cleaning_status).execute()
+        services._auto_reset_done_date = None
+        # 実行済みの場合は読み込み1回のみで、書き込みロックを取らない
+        with query_counter() as counter:
+            maybe_run_auto_reset()
+        assert counter.count == 1 and counter.queries[0].startswith('SELECT')
+        assert RoomState.get(RoomState.room == room).status == cleaning_status
+        assert StateChangeLog.select().where(StateChangeLog.target_type == 'system').count() == 1
+
+    with freeze_time("2026-01-17 04:30:00"):
+        maybe_run_auto_reset()
+        assert RoomState.get(RoomState.room == room).status.key == "vacant"
+
+def test_auto_reset_hook_modes(test_app, monkeypatch):
+    import services
+    calls = []
+    monkeypatch.setattr(services, "maybe_run_auto_reset", lambda: calls.append(1))
+
+    test_app.get("/api/version")
+    assert calls == []
+    test_app.get("/login")
+    assert calls == [1]
+
+    monkeypatch.setattr(config, "AUTO_RESET_MODE", "cron")
+    test_app.get("/login")
+    assert calls == [1]
+
+def test_next_auto_reset_time(monkeypatch):
+    import services
+    monkeypatch.setattr(config, "AUTO_RESET_AT", "04:00")
+    assert services.next_auto_reset_time(datetime.datetime(2026, 1, 16, 3, 0)) == datetime.datetime(2026, 1, 16, 4, 0)
+    assert services.next_auto_reset_time(datetime.datetime(2026, 1, 16, 4, 0)) == datetime.datetime(2026, 1, 17, 4, 0)
+
+def test_connection_closed_after_request(test_app):
+    import models
+    models.db.connect(reuse_if_open=True)
+    test_app.get("/login")
+    assert models.db.is_closed()
+
+def test_pooled_database(monkeypatch, tmp_path):
+    import models
+    from playhouse.pool import PooledSqliteDatabase
+    monkeypatch.setattr(config, "DATABASE_POOL", True)
+    pooled = models.make_database()
+    assert isinstance(pooled, PooledSqliteDatabase)
+    assert pooled._max_connections == config.DATABASE_POOL_MAX_CONNECTIONS
+
+    pooled.init(str(tmp_path / "pool.db"))
+    pooled.connect()
+    conn = pooled.connection()
+    pooled.close()
+    pooled.connect()
+    assert pooled.connection() is conn  # 閉じた接続はプールから再利用される
+    pooled.close_all()
+
+def test_init_db_skips_schema_setup_when_current(db_path, tmp_path, monkeypatch):
+    import models
+    calls = []
+    setup_schema = models.MIGRATIONS[0]
+    monkeypatch.setattr(models, "MIGRATIONS", [lambda: (calls.append(1), setup_schema())] + models.MIGRATIONS[1:])
+    path = str(tmp_path / "fresh.db")
+    try:
+        models.init_db(path)
+        models.init_db(path)  # 2回目はバージョン記録済みなのでテーブル作成・初期データ確認を省略
+        with models.db.connection_context():
+            assert models.db.pragma('user_version') == models.SCHEMA_VERSION
+            assert models.Status.select().count() == len(config.INITIAL_STATUSES)
+    finally:
+        models.db.init(db_path)
+    assert len(calls) == 1
+
+def test_admin_views_loaded_lazily(tmp_path):
+    import os, subprocess, sys
+    code = "import sys, index; assert 'views_admin' not in sys.modules"
+    env = dict(os.environ, WARDBOARD_DATABASE=str(tmp_path / "lazy.db"))
+    subprocess.run([sys.executable, "-c", code], cwd=config.BASE_DIR, env=env, check=True)
+
+def test_serve_worker_handles_requests(app, monkeypatch):
+    import http.client, socket, threading
+    import serve
+    from bottle import Jinja2Template, TEMPLATES, TEMPLATE_PATH
+    import index
+    monkeypatch.setattr(Jinja2Template, "settings", dict(Jinja2Template.settings))
+    index.warm_up()
+    assert (id(TEMPLATE_PATH), "display_board.html") in TEMPLATES
+    assert (id(TEMPLATE_PATH), "admin/logs.html") in TEMPLATES
+
+    sock = serve.create_socket("127.0.0.1", 0)
+    server = serve.PoolWSGIServer(sock, threads=2)
+    server.set_app(app)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", sock.getsockname()[1], timeout=10)
+        conn.request("GET", "/api/version")
+        response = conn.getresponse()
+        assert response.status == 200
+        assert b"WardBoard-OSS" in response.read()
+        conn.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def test_migration_upgrades_existing_database(db_path, tmp_path):
+    import models
+    path = str(tmp_path / "old.db")
+    index_names = "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'statechangelog'"
+    try:
+        # v1 時点のスキーマ（外部キーの単独インデックスのみ）を再現する
+        models.init_db(path)
+        with models.db.connection_context():
+            for (name,) in models.db.execute_sql(index_names).fetchall():
+                models.db.execute_sql(f'DROP INDEX "{name}"')
+            models.db.execute_sql('CREATE INDEX "statechangelog_area_id" ON "statechangelog" ("area_id")')
+            models.db.execute_sql('CREATE INDEX "statechangelog_changed_by_id" ON "statechangelog" ("changed_by_id")')
+            models.db.pragma('user_version', 1)
+
+        models.init_db(path)
+        with models.db.connection_context():
+            assert models.db.pragma('user_version') == models.SCHEMA_VERSION
+            names = {name for (name,) in models.db.execute_sql(index_names).fetchall()}
+    finally:
+        models.db.init(db_path)
+    assert "statechangelog_area_id_changed_at" in names
+    assert "statechangelog_changed_at" in names
+    assert "statechangelog_area_id" not in names
+    assert "statechangelog_changed_by_id" not in names
+
+def test_auto_reset_invalidates_after_commit(admin_user, monkeypatch):
+    import services
+    from models import db
+    monkeypatch.setattr(config, "AUTO_RESET_ENABLED", True)
+    monkeypatch.setattr(config, "AUTO_RESET_RULES", {"cleaning": "vacant"})
+    monkeypatch.setattr(config, "AUTO_RESET_AT", "04:00")
+    room = Room.create(area=Area.create(name="ResetCommit"), code="R1", name="Room1")
+    RoomState.create(room=room, status=Status.get(Status.key == "cleaning"))
+
+    # ボードのキャッシュはコミット後に無効化する（コミット前だと更新前のデータが新しいバージョンでキャッシュされ得る）
+    calls = []
+    monkeypatch.setattr(services, "invalidate_board_cache", lambda area_id=None: calls.append(db.in_transaction()))
+    with freeze_time("2026-01-16 05:00:00"):
+        maybe_run_auto_reset()
+    assert calls == [False]
+
+def test_serve_event_streams_outside_pool(app, monkeypatch):
+    import http.client, threading
+    import serve
+    monkeypatch.setattr(config, "DISPLAY_PUSH_ENABLED", True)
+    monkeypatch.setattr(config, "DISPLAY_PUSH_MAX_DURATION", 2)
+    monkeypatch.setattr(config, "DISPLAY_PUSH_POLL_INTERVAL", 0.1)
+    area = Area.create(name="Stream")
+
+    sock = serve.create_socket("127.0.0.1", 0)
+    server = serve.PoolWSGIServer(sock, threads=1, stream_threads=1)
+    server.set_app(app)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    port = sock.getsockname()[1]
+    try:
+        # 表示端末の接続を保持している間も、1つだけのプールのスレッドで他のリクエストを処理できる
+        stream = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        stream.request("GET", f"/display/board/{area.id}/events")
+        response = stream.getresponse()
+        assert response.status == 200
+        assert response.readline() == b"retry: 3000\n"
+
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.request("GET", "/api/version")
+        assert conn.getresponse().status == 200
+        conn.close()
+
+        # 上限を超えた接続は断る
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.request("GET", f"/display/board/{area.id}/events")
+        assert conn.getresponse().status == 503
+        conn.close()
+        stream.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    assert server.streams.acquire(timeout=10)  # ストリームの終了を待つ
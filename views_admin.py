@@ -1,7 +1,9 @@
-from bottle import get, post, request, redirect, jinja2_template as template
-from models import User, Area, Room, Bed, Status, StateChangeLog
+from bottle import get, post, request, redirect, abort, jinja2_template as template
+from models import db, User, Area, Room, Bed, Status, StateChangeLog
 import auth
+import services
 import datetime
+from urllib.parse import urlencode
 import config
 
 @get('/admin')
@@ -75,6 +77,7 @@ def admin_rooms_create():
         name=request.forms.decode().get('name'),
         sort_order=int(request.forms.decode().get('sort_order', 0))
     )
+    services.invalidate_board_cache()
     return redirect('/admin/rooms')
 
 @get('/admin/rooms/<id:int>/edit')
@@ -88,11 +91,17 @@ def admin_rooms_edit(id):
 @auth.role_required('admin')
 def admin_rooms_update(id):
     room = Room.get_by_id(id)
+    old_area_id = room.area_id
     room.area = request.forms.decode().get('area_id')
     room.code = request.forms.decode().get('code')
     room.name = request.forms.decode().get('name')
     room.sort_order = int(request.forms.decode().get('sort_order', 0))
-    room.save()
+    with db.atomic('IMMEDIATE'):
+        room.save()
+        # エリアが変わった場合はベッドごと移動するため集計カウンタを再構築
+        if str(old_area_id) != str(room.area_id):
+            services.rebuild_counters([old_area_id, room.area_id])
+    services.invalidate_board_cache()
     return redirect('/admin/rooms')
 
 @post('/admin/rooms/<id:int>/toggle_active')
@@ -101,6 +110,7 @@ def admin_rooms_toggle(id):
     room = Room.get_by_id(id)
     room.is_active = not room.is_active
     room.save()
+    services.invalidate_board_cache(room.area_id)
     return redirect('/admin/rooms')
 
 # --- Bed Management ---
@@ -141,13 +151,16 @@ def admin_beds_new():
 @post('/admin/beds/new')
 @auth.role_required('admin')
 def admin_beds_create():
-    Bed.create(
-        room=request.forms.decode().get('room_id'),
-        code=request.forms.decode().get('code'),
-        name=request.forms.decode().get('name'),
-        sort_order=int(request.forms.decode().get('sort_order', 0)),
-        is_available=request.forms.decode().get('is_available') == 'on'
-    )
+    with db.atomic('IMMEDIATE'):
+        bed = Bed.create(
+            room=request.forms.decode().get('room_id'),
+            code=request.forms.decode().get('code'),
+            name=request.forms.decode().get('name'),
+            sort_order=int(request.forms.decode().get('sort_order', 0)),
+            is_available=request.forms.decode().get('is_available') == 'on'
+        )
+        services.rebuild_counters([bed.room.area_id])
+    services.invalidate_board_cache(bed.room.area_id)
     return redirect('/admin/beds')
 
 @get('/admin/beds/<id:int>/edit')
@@ -161,12 +174,17 @@ def admin_beds_edit(id):
 @auth.role_required('admin')
 def admin_beds_update(id):
     bed = Bed.get_by_id(id)
+    old_area_id = bed.room.area_id
     bed.room = request.forms.decode().get('room_id')
     bed.code = request.forms.decode().get('code')
     bed.name = request.forms.decode().get('name')
     bed.sort_order = int(request.forms.decode().get('sort_order', 0))
     bed.is_available = request.forms.decode().get('is_available') == 'on'
-    bed.save()
+    with db.atomic('IMMEDIATE'):
+        bed.save()
+        # 運用可否・所属部屋の変更を集計カウンタに反映
+        services.rebuild_counters({old_area_id, Room.get_by_id(bed.room_id).area_id})
+    services.invalidate_board_cache()
     return redirect('/admin/beds')
 
 @post('/admin/beds/<id:int>/toggle_active')
@@ -174,7 +192,10 @@ def admin_beds_update(id):
 def admin_beds_toggle(id):
     bed = Bed.get_by_id(id)
     bed.is_active = not bed.is_active
-    bed.save()
+    with db.atomic('IMMEDIATE'):
+        bed.save()
+        services.rebuild_counters([bed.room.area_id])
+    services.invalidate_board_cache(bed.room.area_id)
     return redirect('/admin/beds')
 
 # --- Status Management ---
@@ -201,6 +222,7 @@ def admin_statuses_create():
         applies_to_room=request.forms.decode().get('applies_to_room') == 'on',
         applies_to_bed=request.forms.decode().get('applies_to_bed') == 'on'
     )
+    services.invalidate_statuses()
     return redirect('/admin/statuses')
 
 @get('/admin/statuses/<id:int>/edit')
@@ -221,6 +243,7 @@ def admin_statuses_update(id):
     status_obj.applies_to_room = request.forms.decode().get('applies_to_room') == 'on'
     status_obj.applies_to_bed = request.forms.decode().get('applies_to_bed') == 'on'
     status_obj.save()
+    services.invalidate_statuses()
     return redirect('/admin/statuses')
 
 # --- User Management ---
@@ -270,7 +293,9 @@ def admin_users_update(id):
         edit_user.password_hash = password_hash
         edit_user.salt = salt
         
-    edit_user.save()
+    with db.atomic():
+        edit_user.save()
+        auth.revoke_claims()
     return redirect('/admin/users')
 
 @post('/admin/users/<id:int>/toggle_active')
@@ -280,52 +305,58 @@ def admin_users_toggle(id):
     # 自分自身は無効化できない
     if u.id != auth.get_current_user().id:
         u.is_active = not u.is_active
-        u.save()
+        with db.atomic():
+            u.save()
+            auth.revoke_claims()
     return redirect('/admin/users')
 
 # --- Log Management ---
 @get('/admin/logs')
 @auth.role_required('admin')
 def admin_logs():
-    try:
-        query = StateChangeLog.select().order_by(StateChangeLog.changed_at.desc())
-        
-        # フィルタ
-        area_id = request.query.decode().get('area_id')
-        if area_id:
-            query = query.where(StateChangeLog.area == area_id)
-            
-        target_type = request.query.decode().get('target_type')
-        if target_type:
-            query = query.where(StateChangeLog.target_type == target_type)
-            
-        user_id = request.query.decode().get('user_id')
-        if user_id:
-            query = query.where(StateChangeLog.changed_by == user_id)
-        
-        # ページネーション（簡易的に直近100件などでも良いが、一旦全て表示 or 制限なし）
-        logs = list(query.limit(200)) # パフォーマンスのため一旦200件
-        
-        areas = list(Area.select())
-        users = list(User.select())
-        
-        return template('admin/logs.html', 
-                        logs=logs, 
-                        areas=areas, 
-                        users=users,
-                        selected_area=area_id,
-                        selected_target=target_type,
-                        selected_user=user_id,
-                        user=auth.get_current_user(),
-                        config=config)
-    except Exception:
-        raise
+    # フィルタ
+    area_id = request.query.decode().get('area_id')
+    target_type = request.query.decode().get('target_type')
+    user_id = request.query.decode().get('user_id')
+
+    # ページ位置（前ページ最後の履歴の "日時_ID"）
+    before = None
+    before_param = request.query.get('before')
+    if before_param:
+        changed_at, _, log_id = before_param.rpartition('_')
+        try:
+            before = (datetime.datetime.fromisoformat(changed_at), int(log_id))
+        except ValueError:
+            abort(400, "Invalid before")
+
+    logs, next_before = services.get_change_logs(area_id=area_id, target_type=target_type,
+                                                 user_id=user_id, before=before)
+    # ページ移動のリンク（フィルタは引き継ぐ）
+    filters = {k: v for k, v in (('area_id', area_id), ('target_type', target_type), ('user_id', user_id)) if v}
+    first_url = '/admin/logs?' + urlencode(filters)
+    next_url = None
+    if next_before:
+        next_url = '/admin/logs?' + urlencode(dict(filters, before=f"{next_before[0].isoformat()}_{next_before[1]}"))
+
+    areas = list(Area.select())
+    users = list(User.select())
+
+    return template('admin/logs.html',
+                    logs=logs,
+                    areas=areas,
+                    users=users,
+                    selected_area=area_id,
+                    selected_target=target_type,
+                    selected_user=user_id,
+                    first_url=first_url if before else None,
+                    purged=request.query.get('purged'),
+                    freed=request.query.get('freed'),
+                    next_url=next_url,
+                    user=auth.get_current_user(),
+                    config=config)
 
 @post('/admin/logs/purge')
 @auth.role_required('admin')
 def admin_logs_purge():
-    days = config.LOG_RETENTION_DAYS
-    if days > 0:
-        threshold = datetime.datetime.now() - datetime.timedelta(days=days)
-        StateChangeLog.delete().where(StateChangeLog.changed_at < threshold).execute()
-    return redirect('/admin/logs')
+    result = services.purge_logs()
+    return redirect('/admin/logs?' + urlencode({'purged': result['rows'], 'freed': result['pages']}))
@@ -1,9 +1,12 @@
-from bottle import get, post, request, redirect, jinja2_template as template, response
-from models import User, Area, Status, Room, Bed
+from bottle import get, post, request, redirect, jinja2_template as template, response, http_date, parse_date, abort
+from models import db, User, Area, Room, Bed
 import auth
 import services
 import config
 import datetime
+import hashlib
+import json
+import time
 
 # --- v1.4 新機能用ヘルパー ---
 def get_current_theme():
@@ -11,8 +14,37 @@ def get_current_theme():
         return config.DEFAULT_THEME
     return request.get_cookie('theme', config.DEFAULT_THEME)
 
+def not_modified(signature, last_modified, *extra):
+    """
+    ETag / Last-Modified ヘッダを設定し、クライアントの保持している表示が最新なら True を返す
+    extra にはテーマやユーザーなど、同じデータでも表示が変わる要素を渡す
+    """
+    source = '|'.join(str(part) for part in (signature,) + extra)
+    etag = '"%s"' % hashlib.sha1(source.encode('utf-8')).hexdigest()
+    response.set_header('ETag', etag)
+    response.set_header('Cache-Control', 'no-cache')
+    if last_modified:
+        response.set_header('Last-Modified', http_date(time.mktime(last_modified.timetuple())))
+
+    # If-None-Match がある場合はそちらを優先する（Last-Modified は秒単位のため）
+    if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or ('W/' + etag) in tags
+
+    if_modified_since = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified:
+        since = parse_date(if_modified_since.split(';')[0].strip())
+        return since is not None and int(time.mktime(last_modified.timetuple())) <= since
+    return False
+
 # --- フック ---
 def before_request():
+    if config.AUTO_RESET_MODE != 'lazy':
+        return
+    # 静的ファイルや死活監視ではリセット判定を行わない
+    if request.path.startswith('/static/') or request.path == '/api/version':
+        return
     services.maybe_run_auto_reset()
 
 @get('/login')
@@ -25,12 +57,26 @@ def login_page():
 def login_handler():
     username = request.forms.decode().get('username')
     password = request.forms.decode().get('password')
-    
+    remote_addr = request.remote_addr
+
+    # 失敗が続いている場合はパスワード検証（PBKDF2）を行わずに拒否する
+    if auth.is_login_throttled(username, remote_addr):
+        response.status = 429
+        return template('login.html', error='ログインの失敗が続いたため、しばらくしてから再度お試しください。')
+
     user = User.get_or_none(User.username == username, User.is_active == True)
-    if user and auth.verify_password(password, user.salt, user.password_hash):
+    try:
+        verified = user and auth.verify_password_bounded(password, user.salt, user.password_hash)
+    except auth.LoginBusy:
+        response.status = 503
+        return template('login.html', error='ログインが混み合っています。数秒後に再度お試しください。')
+
+    if verified:
+        auth.clear_login_failures(username)
         auth.set_session({'user_id': user.id})
         return redirect('/')
-    
+
+    auth.record_login_failure(username, remote_addr)
     return template('login.html', error='IDまたはパスワードが正しくありません。')
 
 @post('/logout')
@@ -56,11 +102,21 @@ def index():
 @auth.login_required
 def board_page(area_id):
     user = auth.get_current_user()
+    csrf_token = auth.get_csrf_token()
+
+    # 前回表示から変更がなければ描画せずに 304 を返す
+    signature, last_modified = services.get_board_validator(area_id)
+    response.set_header('Vary', 'Cookie')
+    if not_modified(signature, last_modified, area_id, user.id, user.role, csrf_token,
+                    get_current_theme(), config.CONFIRM_STATE_CHANGE):
+        response.status = 304
+        return ''
+
     areas = Area.select().where(Area.is_active == True).order_by(Area.sort_order)
     current_area = Area.get_by_id(area_id)
     
     rooms_data = services.get_board_data(area_id)
-    statuses = Status.select().where(Status.is_active == True).order_by(Status.sort_order)
+    statuses = services.status_registry.active()
     
     return template('board.html', 
                     user=user, 
@@ -68,23 +124,89 @@ def board_page(area_id):
                     current_area=current_area, 
                     rooms_data=rooms_data, 
                     statuses=statuses,
-                    csrf_token=auth.get_csrf_token(),
+                    csrf_token=csrf_token,
                     config=config,
                     current_theme=get_current_theme())
 
 @get('/display/board/<area_id:int>')
 def display_board_page(area_id):
+    # 前回表示から変更がなければ描画せずに 304 を返す
+    signature, last_modified = services.get_board_validator(area_id)
+    if not_modified(signature, last_modified, area_id, get_current_theme(),
+                    config.DISPLAY_REFRESH_INTERVAL, config.DISPLAY_SHOW_UPDATED_AT,
+                    config.DISPLAY_COMPACT, config.DISPLAY_HIDE_EMPTY_ROOMS, config.DISPLAY_PUSH_ENABLED):
+        response.status = 304
+        return ''
+
     current_area = Area.get_by_id(area_id)
     rooms_data = services.get_board_data(area_id)
+    # 空室非表示（DISPLAY_HIDE_EMPTY_ROOMS）は表示する部屋を絞り込み、非表示にした件数を表示する
+    if config.DISPLAY_HIDE_EMPTY_ROOMS:
+        shown = [data for data in rooms_data if not data.is_empty]
+    else:
+        shown = rooms_data
     
     return template('display_board.html', 
                     current_area=current_area, 
-                    rooms_data=rooms_data,
+                    rooms_data=shown,
+                    hidden_count=len(rooms_data) - len(shown),
                     refresh_interval=config.DISPLAY_REFRESH_INTERVAL,
+                    push_enabled=config.DISPLAY_PUSH_ENABLED,
+                    layout_version=services.get_board_layout_version(area_id) if config.DISPLAY_PUSH_ENABLED else None,
                     now=datetime.datetime.now(),
                     config=config,
                     current_theme=get_current_theme())
 
+@get('/api/board/<area_id:int>/changes')
+def board_changes_api(area_id):
+    since = request.query.get('since')
+    if since is not None and not since.isdigit():
+        abort(400, 'since には前回の cursor を指定してください。')
+    response.set_header('Cache-Control', 'no-store')
+    return services.get_board_changes(area_id, int(since) if since is not None else None)
+
+@get('/display/board/<area_id:int>/events')
+def display_board_events(area_id):
+    if not config.DISPLAY_PUSH_ENABLED:
+        abort(404)
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+    response.set_header('X-Accel-Buffering', 'no')  # リバースプロキシでのバッファリングを無効化
+    # 再接続時はブラウザが送る Last-Event-ID（前回のカーソル）から再開する
+    last_event_id = request.environ.get('HTTP_LAST_EVENT_ID', '')
+    return _board_event_stream(area_id, int(last_event_id) if last_event_id.isdigit() else None)
+
+def _board_event_stream(area_id, cursor=None):
+    # カーソル未指定の接続直後は全マスを送り、以降は変更されたマスのみを送る
+    started = last_event = time.monotonic()
+    yield 'retry: 3000\n\n'
+    while True:
+        initial = cursor is None
+        # after_request で接続は閉じられているため、取得の都度接続して返却する
+        with db.connection_context():
+            changes = services.get_board_changes(area_id, cursor)
+        cursor = changes['cursor']
+        cells = changes['rooms'] + changes['beds']
+        now = time.monotonic()
+        # 名称変更・部屋やベッドの追加などは履歴に残らないため、送信のたびに構成の署名を添え、
+        # 表示中の画面と異なれば端末側で再読み込みする
+        if cells or changes['full']:
+            with db.connection_context():
+                layout = services.get_board_layout_version(area_id)
+            payload = {'cells': cells, 'initial': initial, 'layout': layout,
+                       'time': datetime.datetime.now().strftime('%H:%M:%S')}
+            yield 'id: %d\nevent: cells\ndata: %s\n\n' % (cursor, json.dumps(payload, ensure_ascii=False))
+            last_event = now
+        elif now - last_event >= config.DISPLAY_PUSH_HEARTBEAT:
+            with db.connection_context():
+                layout = services.get_board_layout_version(area_id)
+            yield 'event: ping\ndata: %s\n\n' % json.dumps({'layout': layout}, ensure_ascii=False)
+            last_event = now
+
+        if now - started >= config.DISPLAY_PUSH_MAX_DURATION:
+            break
+        services.wait_for_board_change(config.DISPLAY_PUSH_POLL_INTERVAL)
+
 @post('/state/room/<room_id:int>')
 @auth.role_required('operator')
 def update_room_state_handler(room_id):
@@ -111,12 +233,30 @@ def update_bed_state_handler(bed_id):
     area_id = request.forms.decode().get('area_id')
     return redirect(f'/board/{area_id}')
 
+@post('/state/bulk')
+@auth.role_required('operator')
+def update_states_bulk_handler():
+    if not auth.validate_csrf():
+        return "Invalid CSRF Token"
+
+    forms = request.forms.decode()
+    room_ids = [i for i in forms.getall('room_id') if i.isdigit()]
+    bed_ids = [i for i in forms.getall('bed_id') if i.isdigit()]
+    user = auth.get_current_user()
+    if room_ids or bed_ids:
+        services.bulk_update_states(forms.get('status_id'), user, room_ids=room_ids, bed_ids=bed_ids)
+
+    area_id = forms.get('area_id')
+    return redirect(f'/board/{area_id}')
+
 @get('/summary')
 @get('/summary/<area_id:int>')
 @auth.login_required
 def summary_page(area_id=None):
     user = auth.get_current_user()
     summary_data = services.get_bed_counts(area_id)
+    # 全エリア表示時のみ病院全体の合計を表示
+    summary_totals = services.get_bed_totals(summary_data) if not area_id else None
     areas = Area.select().where(Area.is_active == True).order_by(Area.sort_order)
     
     current_area = None
@@ -128,6 +268,7 @@ def summary_page(area_id=None):
                     areas=areas,
                     current_area=current_area,
                     summary_data=summary_data,
+                    summary_totals=summary_totals,
                     config=config,
                     current_theme=get_current_theme())
 